@@ -17,10 +17,24 @@ to process such a S-expression tree.
 from __future__ import annotations
 
 import abc
+import hashlib
 import html
+import json
+import mmap
+import os
+import struct
 import sys
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import Counter, deque
-from collections.abc import Coroutine
+from collections.abc import (
+    Coroutine,
+    Iterable,
+    MutableMapping,
+    MutableSequence,
+    Sequence,
+    Set,
+)
 from dataclasses import dataclass, field
 from enum import IntEnum
 from functools import cached_property
@@ -50,6 +64,10 @@ class HeapOverflow(RuntimeError):
     pass
 
 
+class ReadOnlyHeap(RuntimeError):
+    pass
+
+
 class NotFound(ValueError):
     pass
 
@@ -67,8 +85,9 @@ class Tape:
     An append-only Tape for storing all S-expressions.
     """
 
-    _heap: list[handle_type]
+    _heap: MutableSequence[handle_type]
     """The main storage for the S-expressions.
+    Either a ``list`` or an ``array`` depending on the storage mode.
     """
     _tokens: list[token_type]
     """Store tokens.
@@ -81,13 +100,65 @@ class Tape:
     """
     Auxiliary. Number of records (S-expressions).
     """
+    _record_starts: array
+    """
+    Auxiliary. Sorted heap positions of the `HandleSentry.BEGIN` of every
+    record.
+    """
+    _record_ends: array
+    """
+    Auxiliary. Heap positions of the `HandleSentry.END` of every record.
+    Parallel to `_record_starts`.
+    """
+    _parent_index: dict[handle_type, list[handle_type]] | None
+    """
+    Auxiliary. Map each record to the records that refer to it, in order of
+    occurrence. Built lazily by `parents_of()` and maintained by
+    `write_end()` once built.
+    """
+    _intern_table: dict[tuple[handle_type, ...], handle_type] | None
+    """
+    Auxiliary. Map the body (head and arguments) of every record to its
+    handle. Only used in interning mode.
+    """
 
-    def __init__(self):
+    def __init__(self, *, storage: str = "list", intern: bool = False):
+        """
+        Args:
+            storage (optional):
+                Storage mode of the heap.
+                ``"list"`` uses a Python list.
+                ``"array"`` uses a compact ``array("q")`` that stores each
+                slot as an unboxed 64-bit integer.
+                Defaults to ``"list"``.
+            intern (optional):
+                Enable hash-consing. Writing a record that is identical to
+                an existing record returns the handle of the existing
+                record. Thus, `==` on `SExpr` becomes structural equality.
+                Passes that tell occurrences apart by identity (e.g.
+                `rvsdg.convert_to_lambda` on `VarLoad`) need a tape without
+                interning.
+                Defaults to ``False``.
+        """
         # First item on the heap is the None token
-        self._heap = [0]
+        match storage:
+            case "list":
+                self._heap = [0]
+            case "array":
+                self._heap = array(_heap_typecode, [0])
+            case _:
+                raise ValueError(f"invalid storage mode: {storage!r}")
         self._tokens = [None]
         self._tokenmap = {(type(None), None): 0}
         self._num_records = 0
+        self._record_starts = array(_heap_typecode)
+        self._record_ends = array(_heap_typecode)
+        self._parent_index = None
+        self._head_index = None
+        self._intern_table = {} if intern else None
+        # Caches owned by other modules that are derived from this tape.
+        # Keeping them here releases them together with the tape.
+        self._caches: dict[Any, Any] = {}
         self._open_counter = 0
         self._downcast = lambda x: x
 
@@ -98,6 +169,16 @@ class Tape:
     def heap_size(self) -> int:
         return len(self._heap)
 
+    @property
+    def storage(self) -> str:
+        match self._heap:
+            case array():
+                return "array"
+            case _MappedHeap():
+                return "mmap"
+            case _:
+                return "list"
+
     def __enter__(self):
         self._open_counter += 1
         return self
@@ -119,6 +200,110 @@ class Tape:
         """The main API for creating an `Expr`."""
         return BasicSExpr._write(self, head, args)
 
+    # Serialization API
+
+    def save(self, path: str | os.PathLike) -> None:
+        """Write the tape to `path` in a compact binary format.
+
+        The layout is a fixed header, the token table as JSON, then the
+        heap and the record side-table as raw native-endian int64 arrays,
+        each aligned to 8 bytes so they can be memory-mapped in place.
+        """
+        tokens = json.dumps(self._tokens).encode("utf-8")
+        tokens += b"\0" * (-len(tokens) % _itemsize)
+        nrecords = len(self._record_ends)
+        header = _file_header.pack(
+            _file_magic,
+            _file_version,
+            _file_byteorder_mark,
+            len(self._heap),
+            nrecords,
+            len(tokens),
+        )
+        with open(path, "wb") as fout:
+            fout.write(header)
+            fout.write(tokens)
+            for data in (
+                self._heap,
+                self._record_starts[:nrecords],
+                self._record_ends,
+            ):
+                fout.write(array(_heap_typecode, data).tobytes())
+
+    def digest(self) -> str:
+        """SHA-256 hex digest of the tokens and the heap.
+
+        Tapes with the same records written in the same order have the same
+        digest; e.g. the results of `compact()` for equal trees.
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps(self._tokens).encode("utf-8"))
+        h.update(array(_heap_typecode, self._heap).tobytes())
+        return h.hexdigest()
+
+    @classmethod
+    def from_file(cls, path: str | os.PathLike, *, use_mmap=False) -> Tape:
+        """Load a tape written by `Tape.save()`.
+
+        Args:
+            use_mmap (optional):
+                If true, the heap and the record side-table are
+                memory-mapped read-only from the file instead of being
+                copied. Loading is then independent of the tape size and the
+                pages are shared between processes mapping the same file.
+                The returned tape cannot be written to.
+                Otherwise, the tape is loaded in the ``"array"`` storage
+                mode.
+                Defaults to ``False``.
+        """
+        with open(path, "rb") as fin:
+            raw = fin.read(_file_header.size)
+            if len(raw) < _file_header.size:
+                raise ValueError(f"not a sealir tape file: {path}")
+            magic, version, bom, heap_size, nrecords, ntokbytes = (
+                _file_header.unpack(raw)
+            )
+            if magic != _file_magic:
+                raise ValueError(f"not a sealir tape file: {path}")
+            if version != _file_version:
+                raise ValueError(f"unsupported tape file version: {version}")
+            if bom != _file_byteorder_mark:
+                raise ValueError("tape file has a different byte order")
+            expected = (
+                _file_header.size
+                + ntokbytes
+                + (heap_size + 2 * nrecords) * _itemsize
+            )
+            if os.fstat(fin.fileno()).st_size < expected:
+                raise ValueError(f"truncated tape file: {path}")
+            tokens = json.loads(fin.read(ntokbytes).rstrip(b"\0"))
+
+            offset = _file_header.size + ntokbytes
+            sizes = (heap_size, nrecords, nrecords)
+            if use_mmap:
+                buf = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+                heap = _MappedHeap(buf, offset, heap_size)
+                offset += heap_size * _itemsize
+                tables = []
+                for n in sizes[1:]:
+                    view = memoryview(buf)[offset : offset + n * _itemsize]
+                    tables.append(view.cast(_heap_typecode))
+                    offset += n * _itemsize
+                starts, ends = tables
+            else:
+                heap, starts, ends = (array(_heap_typecode) for _ in sizes)
+                for data, n in zip((heap, starts, ends), sizes):
+                    data.fromfile(fin, n)
+
+        tape = cls(storage="array")
+        tape._heap = heap
+        tape._tokens = tokens
+        tape._tokenmap = {(type(t), t): -i for i, t in enumerate(tokens)}
+        tape._num_records = nrecords
+        tape._record_starts = starts
+        tape._record_ends = ends
+        return tape
+
     # Debug API
 
     def dump_raw(self) -> str:
@@ -126,6 +311,8 @@ class Tape:
         buf.append("\n")
         buf.append("Heap:\n")
         for i, h in enumerate(self._heap):
+            if h >= HandleSentry.BEGIN:
+                h = HandleSentry(h)
             buf.append(f"{i:6} | {repr(h)}\n")
         buf.append("\n")
         buf.append("Tokens:\n")
@@ -180,7 +367,7 @@ class Tape:
                 break
 
         reachable = set()
-        for _, child_rec in crawler.walk_descendants():
+        for child_rec in crawler.iter_descendants():
             reachable.add(child_rec.handle)
 
         crawler.move_to_first_record()
@@ -248,7 +435,9 @@ class Tape:
         return tuple(self._heap[start:stop])
 
     def last(self) -> handle_type:
-        return self.rindex(HandleSentry.BEGIN, len(self._heap) - 1)
+        if not self._record_ends:
+            raise NotFound
+        return self._record_starts[len(self._record_ends) - 1]
 
     # Search API
 
@@ -269,6 +458,222 @@ class Tape:
             raise NotFound
         return pos
 
+    def record_end(self, handle: handle_type) -> handle_type:
+        """Position of the `HandleSentry.END` of the record at `handle`.
+
+        Uses the record side-table instead of scanning the heap.
+        """
+        starts = self._record_starts
+        i = bisect_left(starts, handle)
+        if i >= len(self._record_ends) or starts[i] != handle:
+            raise NotFound(handle)
+        return self._record_ends[i]
+
+    def record_bounds(
+        self, pos: handle_type
+    ) -> tuple[handle_type, handle_type]:
+        """Returns the `(begin, end)` positions of the record containing
+        the heap position `pos`.
+        """
+        i = self._record_ordinal(pos)
+        end = self._record_ends[i]
+        if pos > end:
+            raise NotFound(pos)
+        return self._record_starts[i], end
+
+    def parents_of(self, handle: handle_type) -> tuple[handle_type, ...]:
+        """Handles of the records that immediately refer to the record at
+        `handle`, in order of occurrence.
+
+        The first call builds a reverse-edge index over the whole tape;
+        later writes keep it up to date.
+        """
+        index = self._parent_index
+        if index is None:
+            index = self._parent_index = {}
+            for begin, end in zip(self._record_starts, self._record_ends):
+                self._index_parent(index, begin, end)
+        return tuple(index.get(handle, ()))
+
+    def find_by_head(
+        self,
+        head: str | Iterable[str],
+        start: handle_type = 0,
+        stop: handle_type | None = None,
+        *,
+        within: ReachableSet | None = None,
+    ) -> array:
+        """Handles of the records with the given head(s) in ascending order.
+
+        The first call builds a per-head index over the whole tape;
+        later writes keep it up to date.
+
+        Args:
+            head:
+                A head or a collection of heads.
+            start, stop (optional):
+                Only return handles in the heap range `[start, stop)`.
+            within (optional):
+                Only return handles in this set. Records written after the
+                set was made are not in it.
+        """
+        index = self._head_index
+        if index is None:
+            index = self._head_index = {}
+            heap = self._heap
+            for begin in self._record_starts[: len(self._record_ends)]:
+                self._index_head(index, heap[begin + 1], begin)
+
+        heads = [head] if isinstance(head, str) else head
+        if stop is None:
+            stop = len(self._heap)
+        out = array(_heap_typecode)
+        for h in heads:
+            posting = index.get(self._tokenmap.get((str, h)))
+            if posting is not None:
+                lo = bisect_left(posting, start)
+                hi = bisect_left(posting, stop, lo)
+                out.extend(posting[lo:hi])
+        if not isinstance(head, str):
+            out = array(_heap_typecode, sorted(out))
+        if within is not None:
+            marks = within._marks
+            nmarks = len(marks)
+            out = array(
+                _heap_typecode,
+                (h for h in out if 0 <= h < nmarks and marks[h]),
+            )
+        return out
+
+    def _index_head(
+        self,
+        index: dict[handle_type, array],
+        head_token: handle_type,
+        begin: handle_type,
+    ) -> None:
+        posting = index.get(head_token)
+        if posting is None:
+            posting = index[head_token] = array(_heap_typecode)
+        posting.append(begin)
+
+    def _index_parent(
+        self,
+        index: dict[handle_type, list[handle_type]],
+        begin: handle_type,
+        end: handle_type,
+    ) -> None:
+        for ref in self._heap[begin + 2 : end]:
+            if ref > 0:
+                parents = index.setdefault(ref, [])
+                # a record referring to the same child twice is one parent
+                if not parents or parents[-1] != begin:
+                    parents.append(begin)
+
+    def _record_ordinal(self, pos: handle_type) -> int:
+        """Index into the record side-table of the last record starting at
+        or before `pos`.
+        """
+        i = bisect_right(self._record_starts, pos, 0, len(self._record_ends))
+        if i == 0:
+            raise NotFound(pos)
+        return i - 1
+
+    def _mark_reachable(
+        self, roots: Iterable[handle_type], marks: bytearray | None = None
+    ) -> bytearray:
+        """Returns a bitmap over heap positions where the record start of
+        every record reachable from `roots` is set.
+
+        Children always precede their parents on the tape, so a single
+        reverse sweep of the record side-table from the last root visits
+        each record once.
+
+        If `marks` is given, it is updated in place and returned.
+        """
+        heap = self._heap
+        starts = self._record_starts
+        ends = self._record_ends
+        if marks is None:
+            marks = bytearray(len(heap))
+        last = -1
+        for root in roots:
+            marks[root] = 1
+            last = max(last, self._record_ordinal(root))
+        for i in range(last, -1, -1):
+            begin = starts[i]
+            if marks[begin]:
+                for ref in heap[begin + 2 : ends[i]]:
+                    if ref > 0:
+                        marks[ref] = 1
+        return marks
+
+    # Compaction API
+
+    def compact(
+        self, roots: Iterable[handle_type], *, keep_metadata: bool = True
+    ) -> tuple[Tape, dict[handle_type, handle_type]]:
+        """Copy the records reachable from `roots` into a new tape, dropping
+        everything else.
+
+        Args:
+            roots:
+                Handles of the records to keep.
+            keep_metadata (optional):
+                If true, also keep the metadata records (heads starting with
+                `metadata_prefix`) that refer to at least one surviving
+                record or to no records at all, together with everything
+                they refer to. Thus, a `.md.rewrite` of a surviving
+                replacement keeps the original tree and its own provenance
+                alive.
+                Defaults to ``True``.
+
+        Returns:
+            The new tape and a mapping from the old handles of the surviving
+            records to their new handles. Records keep their relative order.
+        """
+        marks = self._mark_reachable(roots)
+        heap = self._heap
+        tokens = self._tokens
+        if keep_metadata:
+            # Metadata follow the records they refer to, so resurrecting the
+            # records of one metadata can expose more metadata. Iterate
+            # until no more metadata is kept.
+            metadata = [
+                (begin, end)
+                for begin, end in zip(self._record_starts, self._record_ends)
+                if tokens[-heap[begin + 1]].startswith(metadata_prefix)
+            ]
+            while metadata:
+                pending = []
+                kept = []
+                for begin, end in metadata:
+                    refs = [x for x in heap[begin + 2 : end] if x > 0]
+                    if marks[begin] or not refs or any(marks[x] for x in refs):
+                        kept.append(begin)
+                    else:
+                        pending.append((begin, end))
+                if not kept:
+                    break
+                self._mark_reachable(kept, marks)
+                metadata = pending
+
+        out = Tape(
+            storage="list" if self.storage == "list" else "array",
+            intern=self.interning,
+        )
+        remap: dict[handle_type, handle_type] = {}
+        for begin, end in zip(self._record_starts, self._record_ends):
+            if not marks[begin]:
+                continue
+            body = heap[begin + 1 : end]
+            remap[begin] = out.write_record(
+                tuple(
+                    remap[x] if x > 0 else out._get_token_index(tokens[-x])
+                    for x in body
+                )
+            )
+        return out, remap
+
     # Read API
 
     def read_head(self, handle: handle_type) -> str:
@@ -277,18 +682,8 @@ class Tape:
         return out
 
     def read_args(self, handle: handle_type) -> tuple[value_type, ...]:
-        offset = handle + 2
-        buf = []
-        while True:
-            i = self._heap[offset]
-            if i < HandleSentry.END:
-                buf.append(self.read_value(i))
-            elif i == HandleSentry.END:
-                break
-            else:
-                raise HeapOverflow
-            offset += 1
-        return tuple(buf)
+        end = self.record_end(handle)
+        return tuple(map(self.read_value, self._heap[handle + 2 : end]))
 
     def read_value(self, handle: handle_type) -> value_type:
         if handle <= 0:
@@ -304,18 +699,37 @@ class Tape:
 
     # Write API
 
+    @property
+    def interning(self) -> bool:
+        return self._intern_table is not None
+
     def write(self, head: str, args: tuple[value_type, ...]) -> handle_type:
-        handle = self.write_begin()
-        self.write_token(head)
+        body = [self._get_token_index(head)]
         for a in args:
             if isinstance(a, SExpr):
                 if a._tape is not self:
                     raise ValueError(
                         f"invalid to assign Expr({repr(a)}) to a different tape"
                     )
-                self._heap.append(a._handle)
+                body.append(a._handle)
             else:
-                self.write_token(a)
+                body.append(self._get_token_index(a))
+        return self.write_record(tuple(body))
+
+    def write_record(self, body: tuple[handle_type, ...]) -> handle_type:
+        """Write a record given its body, which is the raw heap values of
+        the head token followed by the arguments.
+
+        In interning mode, returns the existing handle if an identical
+        record is already in the tape.
+        """
+        table = self._intern_table
+        if table is not None:
+            handle = table.get(body)
+            if handle is not None:
+                return handle
+        handle = self.write_begin()
+        self._heap.extend(body)
         self.write_end()
         return handle
 
@@ -324,6 +738,9 @@ class Tape:
         self._heap.append(ref)
 
     def write_token(self, token: token_type) -> None:
+        self._heap.append(self._get_token_index(token))
+
+    def _get_token_index(self, token: token_type) -> handle_type:
         if token is not None and not isinstance(token, (int, str, float)):
             raise TypeError(f"invalid token type for {type(token)}")
         last = -len(self._tokens)
@@ -331,18 +748,29 @@ class Tape:
         if handle == last:
             self._tokens.append(token)
             self._tokenmap[type(token), token] = handle
-        self._heap.append(handle)
+        return handle
 
     def write_begin(self) -> handle_type:
         self._guard()
         handle = len(self._heap)
         self._heap.append(HandleSentry.BEGIN)
+        self._record_starts.append(handle)
         return handle
 
     def write_end(self) -> None:
         self._guard()
+        end = len(self._heap)
+        self._record_ends.append(end)
         self._heap.append(HandleSentry.END)
         self._num_records += 1
+        begin = self._record_starts[len(self._record_ends) - 1]
+        if self._parent_index is not None:
+            self._index_parent(self._parent_index, begin, end)
+        if self._head_index is not None:
+            self._index_head(self._head_index, self._heap[begin + 1], begin)
+        if self._intern_table is not None:
+            body = tuple(self._heap[begin + 1 : end])
+            self._intern_table.setdefault(body, begin)
 
     def _guard(self) -> None:
         n = len(self._heap)
@@ -445,12 +873,10 @@ def walk_parents(self: SExpr) -> Iterator[SExpr]:
     object.
     Returned values follow the order of occurrence.
     """
-    crawler = TapeCrawler(self._tape, self._get_downcast())
-    crawler.seek(self._handle)
-    crawler.skip_to_record_end()
-    while crawler.move_to_pos_of(self._handle):
-        yield crawler.read_surrounding_record().to_expr()
-        crawler.skip_to_record_end()
+    tape = self._tape
+    downcast = self._get_downcast()
+    for handle in tape.parents_of(self._handle):
+        yield Record(tape, handle, tape.record_end(handle), downcast).to_expr()
 
 
 def search_parents(
@@ -533,6 +959,66 @@ def walk_descendants_depth_first(
                 stack.append((arg, (*parents, node)))
 
 
+def walk_descendants_fold(
+    self: SExpr, fold: Callable[[T, SExpr], T], init: T
+) -> Iterator[tuple[T, SExpr]]:
+    """Walk descendants of this Expr node.
+    Breath-first order. Left to right.
+
+    Instead of the chain of parents, yields a state folded along it.
+    The state of a child is `fold(state_of_parent, parent)`. The state of
+    this node is `init`. Each step costs O(1) regardless of the depth.
+
+    Yields (state, node)
+    """
+    tape = self._tape
+    heap = tape._heap
+    downcast = self._get_downcast()
+    todos: deque[tuple[T, handle_type]] = deque([(init, self._handle)])
+    while todos:
+        state, handle = todos.popleft()
+        node = _to_expr(tape, handle, downcast)
+        yield state, node
+        child_state = fold(state, node)
+        for ref in heap[handle + 2 : tape.record_end(handle)]:
+            if ref > 0:
+                todos.append((child_state, ref))
+
+
+def walk_descendants_with_depth(
+    self: SExpr,
+) -> Iterator[tuple[int, SExpr]]:
+    """Walk descendants of this Expr node.
+    Breath-first order. Left to right.
+
+    Yields (depth, node). This node has depth 0.
+    """
+    return walk_descendants_fold(self, lambda depth, _: depth + 1, 0)
+
+
+def walk_descendants_with_parent(
+    self: SExpr,
+) -> Iterator[tuple[SExpr | None, SExpr]]:
+    """Walk descendants of this Expr node.
+    Breath-first order. Left to right.
+
+    Yields (parent, node). The parent of this node is None.
+    """
+    return walk_descendants_fold(self, lambda _, parent: parent, None)
+
+
+def iter_descendants(self: SExpr) -> Iterator[SExpr]:
+    """Walk descendants of this Expr node.
+    Breath-first order. Left to right.
+    """
+    for _, node in walk_descendants_fold(self, _fold_nothing, None):
+        yield node
+
+
+def _fold_nothing(state: None, parent: SExpr) -> None:
+    return None
+
+
 def search_descendants(
     self: SExpr, pred: Callable[[SExpr], bool]
 ) -> Iterator[tuple[tuple[SExpr, ...], SExpr]]:
@@ -545,17 +1031,35 @@ def traverse(
     self: SExpr,
     corofunc: Callable[[SExpr, TraverseState], Coroutine[SExpr, T, T]],
     state: TraverseState | None = None,
-) -> dict[SExpr, T]:
+    *,
+    memo_by_handle: bool = False,
+    memo: MutableMapping[SExpr, T] | None = None,
+) -> MutableMapping[SExpr, T]:
     """Traverses the expression tree rooted at the current node, applying
     the provided coroutine function to each node in a depth-first order.
     The traversal is memoized, so that if a node is encountered more than
     once, the result from the first visit is reused. The function returns
     a dictionary mapping each visited node to the value returned by the
     coroutine function for that node.
+
+    Args:
+        memo_by_handle (optional):
+            If true, the memo is a `HandleMemo`. All visited nodes must
+            then be in the same tape as this node.
+            Defaults to ``False``.
+        memo (optional):
+            An existing memo to continue from. Nodes already in it are not
+            visited again. It is updated in place and returned.
+            Overrides `memo_by_handle`.
     """
     stack: list[tuple[Coroutine[SExpr, T, T], SExpr, SExpr]]
     stack = []
-    memo = {}
+    if memo is None:
+        memo = (
+            HandleMemo(self._tape, self._get_downcast())
+            if memo_by_handle
+            else {}
+        )
     cur_node = self
     state = state or TraverseState()
     coro = corofunc(cur_node, state)
@@ -589,8 +1093,14 @@ def traverse(
     return memo
 
 
-def reachable_set(self: SExpr) -> set[SExpr]:
-    return {node for _, node in walk_descendants_depth_first_no_repeat(self)}
+def reachable_set(self: SExpr) -> ReachableSet:
+    """Returns the set of expressions reachable from `self`, including
+    `self`.
+
+    Computed with a single reverse sweep over the tape.
+    """
+    marks = self._tape._mark_reachable([self._handle])
+    return ReachableSet(self._tape, marks, self._get_downcast())
 
 
 def contains(self: SExpr, test: SExpr) -> bool:
@@ -608,7 +1118,7 @@ def apply_bottomup(
     self: SExpr,
     visitor: TreeVisitor,
     *,
-    reachable: set[SExpr] | None | LiteralString = "compute",
+    reachable: ReachableSet | set[SExpr] | None | LiteralString = "compute",
 ) -> None:
     """
     Apply the TreeVisitor to every sexpr bottom up. When a sexpr is visited,
@@ -629,6 +1139,20 @@ def apply_bottomup(
         case str():
             raise ValueError(f"invalid input for `reachable`: {reachable!r}")
 
+    match reachable:
+        case ReachableSet():
+            tape = self._tape
+            tokens = tape._tokens
+            heap = tape._heap
+            downcast = self._get_downcast()
+            for handle in reachable.handles():
+                if handle > self._handle:
+                    break
+                head = tokens[-heap[handle + 1]]
+                if not head.startswith(metadata_prefix):
+                    visitor.visit(downcast(BasicSExpr(tape, handle)))
+            return
+
     crawler = TapeCrawler(self._tape, self._get_downcast())
     match reachable:
         case set():
@@ -771,25 +1295,19 @@ def copy_tree_into(self: SExpr, tape: Tape) -> SExpr:
     Returns a fresh Expr in the new tape.
     """
     oldtree = self._tape
-    crawler = TapeCrawler(oldtree, self._get_downcast())
-    crawler.seek(self._handle)
-    liveset = set(_select(crawler.walk_descendants(), 1))
-    surviving = sorted(liveset)
     mapping = {}
-    for oldrec in surviving:
-        head = oldtree.read_head(oldrec.handle)
-        args = oldtree.read_args(oldrec.handle)
-
-        mapping[oldrec.handle] = tape.write_begin()
-        tape.write_token(head)
+    for handle in reachable_set(self).handles():
+        head = oldtree.read_head(handle)
+        args = oldtree.read_args(handle)
 
+        body = [tape._get_token_index(head)]
         for arg in args:
             if isinstance(arg, SExpr):
-                tape.write_ref(mapping[arg._handle])
+                body.append(mapping[arg._handle])
             else:
-                tape.write_token(arg)
+                body.append(tape._get_token_index(arg))
 
-        tape.write_end()
+        mapping[handle] = tape.write_record(tuple(body))
 
     out = tape.read_value(mapping[self._handle])
     assert isinstance(out, SExpr)
@@ -874,7 +1392,7 @@ class TapeCrawler:
         self._pos += 1
 
     def skip_to_record_end(self):
-        self._pos = self._tape.index(HandleSentry.END, self._pos + 1)
+        _, self._pos = self._tape.record_bounds(self._pos)
 
     def walk(self) -> Iterator[Record]:
         while self._pos < self._tape.heap_size:
@@ -895,17 +1413,28 @@ class TapeCrawler:
             for child in rec.children():
                 todos.append(((*parents, rec), child))
 
+    def iter_descendants(self) -> Iterator[Record]:
+        """Walk all descendants starting from the current position.
+        Breath-first order.
+
+        Like `walk_descendants()` but without the parents.
+        """
+        todos: deque[Record] = deque([self.read_record()])
+        while todos:
+            rec = todos.popleft()
+            yield rec
+            todos.extend(rec.children())
+
     def read_record(self) -> Record:
         assert self._tape.get(self._pos) == HandleSentry.BEGIN
         begin = self._pos
-        end = self._tape.index(HandleSentry.END, begin)
+        end = self._tape.record_end(begin)
         rec = Record(self._tape, begin, end, self._downcast)
         self._pos = end + 1
         return rec
 
     def read_surrounding_record(self) -> Record:
-        start = self._tape.rindex(HandleSentry.BEGIN, self._pos)
-        stop = self._tape.index(HandleSentry.END, self._pos)
+        start, stop = self._tape.record_bounds(self._pos)
         return Record(self._tape, start, stop, self._downcast)
 
     def move_to_pos_of(self, target: handle_type) -> bool:
@@ -918,10 +1447,13 @@ class TapeCrawler:
 
     def move_to_previous_record(self, startpos=None) -> None:
         startpos = startpos or self._pos
-        # Move to start of current
-        self._pos = self._tape.rindex(HandleSentry.BEGIN, startpos)
+        tape = self._tape
+        # Find current
+        i = tape._record_ordinal(startpos)
         # Move to start of previous
-        self._pos = self._tape.rindex(HandleSentry.BEGIN, self._pos - 1)
+        if i == 0:
+            raise NotFound
+        self._pos = tape._record_starts[i - 1]
 
 
 @dataclass(frozen=True, order=True)
@@ -936,7 +1468,7 @@ class Record:
         body = self.tape.load(self.handle + 1, self.end_handle)
         for h in body:
             if h > 0:  # don't include tokens
-                end = self.tape.index(HandleSentry.END, h)
+                end = self.tape.record_end(h)
                 yield type(self)(self.tape, h, end, self.downcast)
 
     def read_head(self):
@@ -946,20 +1478,202 @@ class Record:
         return self.tape.read_args(self.handle)
 
     def to_expr(self) -> SExpr:
-        base = BasicSExpr(self.tape, self.handle)
-        if is_metadata(base):
-            return base
-        return self.downcast(base)
+        return _to_expr(self.tape, self.handle, self.downcast)
 
     def __repr__(self):
         return f"<Record {self.handle}:{self.end_handle} tape@{hex(id(self.tape))} >"
 
 
-def _select(iterable, idx: int):
-    for args in iterable:
-        yield args[idx]
+class HandleMemo(MutableMapping[SExpr, T]):
+    """A memo for the expressions of a single tape, stored in a list
+    indexed by handle.
+
+    Lookups do not hash the keys. Keys are only re-created when iterated.
+    The tape is bound on the first insertion if not given. Keys are
+    re-created with `downcast`, which defaults to that of the first key
+    inserted.
+    """
+
+    __slots__ = ("_tape", "_values", "_len", "_downcast")
+
+    _tape: Tape | None
+    _values: list[Any]
+    _downcast: Callable[[SExpr], SExpr] | None
+
+    def __init__(
+        self,
+        tape: Tape | None = None,
+        downcast: Callable[[SExpr], SExpr] | None = None,
+    ):
+        self._tape = tape
+        self._values = []
+        self._len = 0
+        self._downcast = downcast
+
+    def lookup_handle(self, handle: handle_type) -> T:
+        """Same as `memo[expr]` but takes the handle of `expr`."""
+        try:
+            out = self._values[handle]
+        except IndexError:
+            raise KeyError(handle)
+        if out is _unset:
+            raise KeyError(handle)
+        return out
+
+    def __getitem__(self, key: SExpr) -> T:
+        if not isinstance(key, SExpr) or key._tape is not self._tape:
+            raise KeyError(key)
+        try:
+            return self.lookup_handle(key._handle)
+        except KeyError:
+            raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        if not isinstance(key, SExpr) or key._tape is not self._tape:
+            return False
+        handle = key._handle
+        values = self._values
+        return handle < len(values) and values[handle] is not _unset
+
+    def __setitem__(self, key: SExpr, value: T) -> None:
+        tape = self._tape
+        if tape is None:
+            tape = self._tape = key._tape
+        elif key._tape is not tape:
+            raise ValueError(f"{key!r} is not in the tape of this memo")
+        if self._downcast is None:
+            self._downcast = key._get_downcast()
+        handle = key._handle
+        values = self._values
+        if handle >= len(values):
+            size = max(handle + 1, tape.heap_size)
+            values.extend([_unset] * (size - len(values)))
+        if values[handle] is _unset:
+            self._len += 1
+        values[handle] = value
+
+    def __delitem__(self, key: SExpr) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self._values[key._handle] = _unset
+        self._len -= 1
+
+    def __iter__(self) -> Iterator[SExpr]:
+        tape = self._tape
+        downcast = self._downcast
+        for handle, value in enumerate(self._values):
+            if value is not _unset:
+                yield _to_expr(tape, handle, downcast)
+
+    def __len__(self) -> int:
+        return self._len
+
+
+_unset: Any = object()
+"""Marks an empty slot in `HandleMemo`."""
+
+
+class ReachableSet(Set[SExpr]):
+    """An immutable set of the expressions of a tape, stored as a bitmap
+    over the heap positions.
+
+    Iteration is in tape order; i.e. children before parents.
+    """
+
+    __slots__ = ("_tape", "_marks", "_downcast", "_len")
+
+    def __init__(
+        self,
+        tape: Tape,
+        marks: bytearray,
+        downcast: Callable[[SExpr], SExpr],
+    ):
+        self._tape = tape
+        self._marks = marks
+        self._downcast = downcast
+        self._len = marks.count(1)
+
+    def __contains__(self, value) -> bool:
+        if not isinstance(value, SExpr) or value._tape is not self._tape:
+            return False
+        handle = value._handle
+        return 0 <= handle < len(self._marks) and bool(self._marks[handle])
+
+    def __iter__(self) -> Iterator[SExpr]:
+        tape = self._tape
+        for handle in self.handles():
+            yield _to_expr(tape, handle, self._downcast)
 
+    def __len__(self) -> int:
+        return self._len
+
+    def handles(self) -> Iterator[handle_type]:
+        """Handles of the expressions in ascending order."""
+        marks = self._marks
+        pos = marks.find(1)
+        while pos >= 0:
+            yield pos
+            pos = marks.find(1, pos + 1)
+
+
+def _to_expr(
+    tape: Tape, handle: handle_type, downcast: Callable[[SExpr], SExpr]
+) -> SExpr:
+    base = BasicSExpr(tape, handle)
+    if is_metadata(base):
+        return base
+    return downcast(base)
+
+
+_heap_typecode = "q"
+"""Array typecode for the ``"array"`` storage mode.
+Signed 64-bit because tokens are negative and the sentries are above the
+signed 32-bit range.
+"""
+_itemsize = array(_heap_typecode).itemsize
+
+_file_magic = b"SEALTAPE"
+_file_version = 1
+_file_byteorder_mark = 0x0102_0304_0506_0708
+_file_header = struct.Struct("=8sqqqqq")
 
 token_type: TypeAlias = Union[int, float, str, None]
 value_type: TypeAlias = Union[token_type, SExpr]
 handle_type: TypeAlias = int
+
+
+class _MappedHeap(Sequence[handle_type]):
+    """A read-only heap over a memory-mapped tape file."""
+
+    def __init__(self, buf: mmap.mmap, offset: int, size: int) -> None:
+        self._buf = buf
+        self._offset = offset
+        self._stop = offset + size * _itemsize
+        self._view = memoryview(buf)[offset : self._stop].cast(_heap_typecode)
+
+    def __len__(self) -> int:
+        return len(self._view)
+
+    def __getitem__(self, index):
+        return self._view[index]
+
+    def index(self, value, start=0, stop=sys.maxsize) -> int:
+        # Search the raw bytes and skip matches that are not aligned to
+        # an item.
+        needle = array(_heap_typecode, [value]).tobytes()
+        pos = self._offset + max(start, 0) * _itemsize
+        end = min(self._stop, self._offset + stop * _itemsize)
+        while True:
+            found = self._buf.find(needle, pos, end)
+            if found < 0:
+                raise ValueError(f"{value} is not in heap")
+            rel = found - self._offset
+            if rel % _itemsize == 0:
+                return rel // _itemsize
+            pos = found + 1
+
+    def append(self, value) -> None:
+        raise ReadOnlyHeap("tape is memory-mapped read-only")
+
+    def extend(self, values) -> None:
+        raise ReadOnlyHeap("tape is memory-mapped read-only")
@@ -0,0 +1,70 @@
+"""Helpers shared by the on-disk caches of derived data (e.g.
+`rvsdg.RestructureCache` and `llvm_pyapi_backend.JitCache`).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import importlib.metadata
+import os
+import tempfile
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator
+
+
+@lru_cache(maxsize=None)
+def package_versions(*names: str) -> tuple[str, ...]:
+    """The versions of sealir and of the distributions `names`, to be made
+    part of cache keys.
+
+    A source checkout of sealir that is not installed is identified by a
+    digest of its sources instead. Distributions that are not installed
+    have the version ``"unknown"``.
+    """
+    try:
+        sealir_version = importlib.metadata.version("sealir")
+    except importlib.metadata.PackageNotFoundError:
+        sealir_version = _source_digest()
+    versions = [sealir_version]
+    for name in names:
+        try:
+            versions.append(importlib.metadata.version(name))
+        except importlib.metadata.PackageNotFoundError:
+            versions.append("unknown")
+    return tuple(versions)
+
+
+def _source_digest() -> str:
+    pkgdir = os.path.dirname(__file__)
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(pkgdir):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.endswith(".py"):
+                path = os.path.join(dirpath, name)
+                digest.update(os.path.relpath(path, pkgdir).encode())
+                with open(path, "rb") as fin:
+                    digest.update(fin.read())
+    return digest.hexdigest()
+
+
+@contextmanager
+def atomic_write(path: str | os.PathLike) -> Iterator[str]:
+    """Yields a temporary path in the directory of `path` to write to.
+
+    On success, the temporary file replaces `path` in one step, so readers
+    never see a partial file. On error, it is removed.
+    """
+    directory = os.path.dirname(os.fspath(path)) or "."
+    fd, tmppath = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        yield tmppath
+        os.replace(tmppath, path)
+    except BaseException:
+        try:
+            os.unlink(tmppath)
+        except FileNotFoundError:
+            pass
+        raise
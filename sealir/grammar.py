@@ -1,8 +1,10 @@
 from __future__ import annotations
 
-from collections import ChainMap
+import inspect
+import weakref
+from collections import ChainMap, OrderedDict
 from collections.abc import Mapping, MutableMapping
-from functools import cached_property, lru_cache
+from functools import cached_property
 from itertools import chain, cycle
 from types import UnionType
 from typing import (
@@ -25,13 +27,32 @@ Tgrammar = TypeVar("Tgrammar", bound="Grammar")
 T = TypeVar("T")
 
 
+class DowncastCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int | None
+    currsize: int
+
+
 class Grammar:
     start: type[Rule] | UnionType
 
+    downcast_cache_size: int | None = None
+    """Maximum number of downcast expressions cached per tape.
+    Least recently used entries are evicted first.
+    `None` means unbounded. `0` disables the cache.
+    """
+
+    _named_subclasses: dict[type[Rule], type[NamedSExpr]]
+    """Maps rules to the NamedSExpr subclasses bound to this grammar. Owned
+    by each grammar class so that it is released with the grammar.
+    """
+
     def __init__(self, tape: ase.Tape) -> None:
         self._tape = tape
 
     def __init_subclass__(cls) -> None:
+        cls._named_subclasses = {}
         if isinstance(cls.start, UnionType):
             newcls: type[_CombinedRule] = type(
                 "_CombinedRule",
@@ -52,17 +73,35 @@ class Grammar:
         return bounded._wrap(expr._tape, expr._handle)
 
     @classmethod
-    @lru_cache(maxsize=4096)
     def downcast(
         cls: type[Tgrammar], expr: ase.SExpr
     ) -> NamedSExpr[Tgrammar, Trule]:
-        head = expr._head
-        try:
-            rulety = cls.start._rules[head]
-        except KeyError:
-            raise ValueError(f"{head!r} is not valid in the grammar")
-        else:
-            return NamedSExpr._subclass(cls, rulety)(expr)
+        cache = cls._get_downcast_cache(expr._tape)
+        out = cache.get(expr._handle)
+        if out is None:
+            head = expr._head
+            try:
+                rulety = cls.start._rules[head]
+            except KeyError:
+                raise ValueError(f"{head!r} is not valid in the grammar")
+            out = NamedSExpr._subclass(cls, rulety)(expr)
+            cache.put(expr._handle, out)
+        return out
+
+    @classmethod
+    def downcast_cache_info(cls, tape: ase.Tape) -> DowncastCacheInfo:
+        """Statistics of the downcast cache of this grammar for `tape`."""
+        return cls._get_downcast_cache(tape).info()
+
+    @classmethod
+    def _get_downcast_cache(cls, tape: ase.Tape) -> _DowncastCache:
+        per_tape = _downcast_caches.get(tape)
+        if per_tape is None:
+            per_tape = _downcast_caches[tape] = {}
+        cache = per_tape.get(cls)
+        if cache is None:
+            cache = per_tape[cls] = _DowncastCache(cls.downcast_cache_size)
+        return cache
 
     def __enter__(self) -> Self:
         self._tape.__enter__()
@@ -72,6 +111,58 @@ class Grammar:
         self._tape.__exit__(exc_val, exc_typ, exc_tb)
 
 
+class _DowncastCache:
+    """Maps handles to the downcast expressions of one tape.
+
+    Entries are weak references. The expressions refer to their tape, so
+    holding them strongly would keep the tape alive. An expression stays
+    cached for as long as something else uses it, such as the `_args` of a
+    live parent, and until it is evicted.
+    """
+
+    def __init__(self, maxsize: int | None) -> None:
+        self._maxsize = maxsize
+        self._refs: dict[ase.handle_type, weakref.ref[NamedSExpr]]
+        self._refs = {} if maxsize is None else OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, handle: ase.handle_type) -> NamedSExpr | None:
+        ref = self._refs.get(handle)
+        if ref is not None:
+            out = ref()
+            if out is not None:
+                self._hits += 1
+                if self._maxsize is not None:
+                    self._refs.move_to_end(handle)
+                return out
+        self._misses += 1
+        return None
+
+    def put(self, handle: ase.handle_type, expr: NamedSExpr) -> None:
+        maxsize = self._maxsize
+        if maxsize == 0:
+            return
+        refs = self._refs
+        refs[handle] = weakref.ref(expr)
+        if maxsize is not None:
+            refs.move_to_end(handle)
+            if len(refs) > maxsize:
+                refs.popitem(last=False)
+
+    def info(self) -> DowncastCacheInfo:
+        currsize = sum(1 for ref in self._refs.values() if ref() is not None)
+        return DowncastCacheInfo(
+            self._hits, self._misses, self._maxsize, currsize
+        )
+
+
+_downcast_caches: weakref.WeakKeyDictionary[
+    ase.Tape, dict[type[Grammar], _DowncastCache]
+] = weakref.WeakKeyDictionary()
+"""The downcast caches of each live tape, per grammar."""
+
+
 class _Field(NamedTuple):
     name: str
     annotation: Any
@@ -189,16 +280,36 @@ class _CombinedRule(Rule):
 class NamedSExpr(ase.SExpr, Generic[Tgrammar, Trule]):
     _grammar: type[Grammar]
     _rulety: type[Rule]
+    _slots: dict[str, int]
+    __match_args__: tuple[str, ...]
 
     @classmethod
     def _subclass(
         cls, grammar: type[Tgrammar], rule: type[Trule]
     ) -> type[NamedSExpr[Tgrammar, Trule]]:
+        """Returns the NamedSExpr subclass bound to `grammar` and `rule`.
+
+        The subclass is created once per pair so that all nodes of the same
+        rule share a type. It is stored on `grammar`.
+        """
+        try:
+            return grammar._named_subclasses[rule]
+        except KeyError:
+            pass
         assert issubclass(grammar, Grammar)
         assert issubclass(rule, Rule)
-        return type(
-            cls.__name__, (NamedSExpr,), dict(_grammar=grammar, _rulety=rule)
+        subclass = type(
+            cls.__name__,
+            (NamedSExpr,),
+            dict(
+                _grammar=grammar,
+                _rulety=rule,
+                _slots={k: i for i, k in enumerate(rule.__match_args__)},
+                __match_args__=rule.__match_args__,
+            ),
         )
+        grammar._named_subclasses[rule] = subclass
+        return subclass
 
     @classmethod
     def _wrap(cls, tape: ase.Tape, handle: ase.handle_type) -> Self:
@@ -209,10 +320,7 @@ class NamedSExpr(ase.SExpr, Generic[Tgrammar, Trule]):
         assert self._rulety
         self._tape = expr._tape
         self._handle = expr._handle
-        rulety = self._rulety
-        self._slots = {k: i for i, k in enumerate(rulety.__match_args__)}
         self._expr = expr
-        self.__match_args__ = rulety.__match_args__
 
     def __getattr__(
         self, name: str
@@ -221,7 +329,7 @@ class NamedSExpr(ase.SExpr, Generic[Tgrammar, Trule]):
             return super().__getattribute__(name)
         try:
             idx = self._slots[name]
-        except IndexError:
+        except KeyError:
             raise AttributeError(name)
 
         if idx + 1 == len(self._rulety._fields):
@@ -270,15 +378,21 @@ class NamedSExpr(ase.SExpr, Generic[Tgrammar, Trule]):
             out[self.__match_args__[i]] = args[i]
 
         if pack_last:
-            out[self.__match_args__[-1]] = tuple(args[i:])
+            out[self.__match_args__[-1]] = tuple(args[npos:])
         return out
 
 
 class TreeRewriter(rewriter.TreeRewriter[T]):
     grammar: Grammar | None = None
 
+    _call_plans: dict[type[Rule], _CallPlan | None]
+    """Maps rules to how their `rewrite_<head>` method is called.
+    Filled lazily.
+    """
+
     def __init__(self, grammar: Grammar | None = None):
         super().__init__()
+        self._call_plans = {}
         if grammar is not None:
             self.grammar = grammar
 
@@ -293,9 +407,44 @@ class TreeRewriter(rewriter.TreeRewriter[T]):
             assert isinstance(orig, NamedSExpr), repr(orig)
         else:
             orig = self.grammar.downcast(orig)
-        fname = f"rewrite_{orig._head}"
-        fn = getattr(self, fname, None)
-        if fn is not None:
-            return fn(orig, **orig._bind(*args))
+        rulety = orig._rulety
+        try:
+            plan = self._call_plans[rulety]
+        except KeyError:
+            plan = self._call_plans[rulety] = self._make_call_plan(rulety)
+        if plan is not None:
+            return plan(orig, args)
         else:
             return self.rewrite_generic(orig, args, updated)
+
+    def _make_call_plan(self, rulety: type[Rule]) -> _CallPlan | None:
+        fn = self._get_rewrite_handler(rulety._sexpr_head)
+        if fn is None:
+            return None
+        names = rulety.__match_args__
+        if not _takes_fields_positionally(fn, names):
+            return lambda orig, args: fn(orig, **orig._bind(*args))
+        elif names and rulety._fields[-1].is_vararg():
+            npos = len(names) - 1
+            return lambda orig, args: fn(orig, *args[:npos], args[npos:])
+        else:
+            return lambda orig, args: fn(orig, *args)
+
+
+_CallPlan = Callable[[NamedSExpr, tuple], Any]
+
+
+def _takes_fields_positionally(
+    fn: Callable[..., Any], names: tuple[str, ...]
+) -> bool:
+    """Checks if `fn(orig, ...)` takes exactly the fields `names` as its
+    remaining parameters, in order, so that binding by keyword can be
+    skipped.
+    """
+    try:
+        params = list(inspect.signature(fn).parameters.values())[1:]
+    except (TypeError, ValueError):
+        return False
+    return tuple(p.name for p in params) == names and all(
+        p.kind == inspect.Parameter.POSITIONAL_OR_KEYWORD for p in params
+    )
@@ -130,9 +130,7 @@ def format(expr: ase.SExpr) -> str:
 
 def simplify(grm: grammar.Grammar) -> grammar.Grammar:
     """Make a copy and remove dead node. Last node is assumed to be root."""
-    last = ase.BasicSExpr(grm._tape, grm._tape.last())
-    new_tree = ase.Tape()
-    ase.copy_tree_into(last, new_tree)
+    new_tree, _ = grm._tape.compact([grm._tape.last()], keep_metadata=False)
     return type(grm)(new_tree)
 
 
@@ -149,11 +147,16 @@ def beta_reduction(app_expr: ase.SExpr) -> ase.SExpr:
 
     napps = len(app_exprs)
 
+    def fold_lams(lams: tuple[Lam, ...], parent: ase.SExpr):
+        # stop collecting beyond `napps`; these are too deep anyway
+        if isinstance(parent, Lam) and len(lams) <= napps:
+            return (*lams, parent)
+        return lams
+
     arg2repl = {}
     drops = set(app_exprs)
-    for parents, child in ase.walk_descendants(app_expr):
+    for lams, child in ase.walk_descendants_fold(app_expr, fold_lams, ()):
         if isinstance(child, Arg):
-            lams = [x for x in parents if isinstance(x, Lam)]
             if len(lams) <= napps:  # don't go deeper
                 debruijn = child.index
                 # in range?
@@ -326,13 +329,16 @@ def format_lambda(expr: ase.SExpr):
 
             return "\n".join(lines)
 
-    descendants = list(ase.walk_descendants(expr))
+    def fold_parents(state, parent: ase.SExpr):
+        # track the (nearest Lam parent, immediate parent)
+        lam_parent, _ = state
+        if parent._head == "Lam":
+            lam_parent = parent
+        return lam_parent, parent
 
-    def first_lam_parent(parents) -> ase.SExpr | None:
-        for p in reversed(parents):
-            if p._head == "Lam":
-                return p
-        return None
+    descendants = list(
+        ase.walk_descendants_fold(expr, fold_parents, (None, None))
+    )
 
     def fmt(node):
         ret = formatted.get(node)
@@ -362,12 +368,13 @@ def format_lambda(expr: ase.SExpr):
     grouped: defaultdict[ase.SExpr | None, LamScope]
     grouped = defaultdict(LamScope)
 
-    for ident, (parents, child) in enumerate(reversed(descendants)):
-        lam_parent = first_lam_parent(parents)
+    for ident, ((lam_parent, parent), child) in enumerate(
+        reversed(descendants)
+    ):
         scope = grouped[lam_parent]
         formatted, wr = scope.formatted, scope.writer
         if child not in formatted:
-            if ase.is_simple(child) and parents:
+            if ase.is_simple(child) and parent is not None:
                 parts = [
                     f"{child._head}",
                     *map(fmt, child._args),
@@ -377,7 +384,7 @@ def format_lambda(expr: ase.SExpr):
                 child_scope = grouped[child]
                 child_scope.lambda_depth = compute_lam_depth(child)
 
-                if not parents or parents[-1]._head != "Lam":
+                if parent is None or parent._head != "Lam":
                     # top-level lambda in this chain
                     wr.write(
                         "let",
@@ -1,32 +1,134 @@
 from __future__ import annotations
 
 import ctypes as _ct
+import hashlib
+import os
 import sys
 from contextlib import contextmanager
 from dataclasses import dataclass, field, replace
-from typing import Any, Callable, Self
+from typing import Any, Callable, NamedTuple, Self, Sequence
 
 from llvmlite import binding as llvm
 from llvmlite import ir
 
 from sealir import ase, lam, rvsdg
+from sealir.cache_utils import atomic_write, package_versions
 
 ll_byte = ir.IntType(8)
 ll_pyobject_ptr = ll_byte.as_pointer()
 ll_iostate = ir.LiteralStructType([])  # empty struct
-
-
-def llvm_codegen(root: ase.SExpr):
+ll_bool = ir.IntType(1)
+ll_i64 = ir.IntType(64)
+ll_double = ir.DoubleType()
+
+
+def llvm_codegen(
+    root: ase.SExpr,
+    *,
+    cache: JitCache | None = None,
+    opt: int = 2,
+    dump_ir: str | os.PathLike | None = None,
+    argtypes: Sequence[type] | None = None,
+):
+    """Compile the lambda expression `root` of a function into a callable.
+
+    Args:
+        cache (optional):
+            If given, the object code is looked up in and added to this
+            cache; a hit skips code generation entirely.
+        opt (optional):
+            Optimization level, 0 to 3, of the LLVM pipeline and of the
+            machine code generation.
+            Defaults to ``2``.
+        dump_ir (optional):
+            If given, write the LLVM IR before and after optimization to
+            this file. Nothing is written on a cache hit.
+        argtypes (optional):
+            Types of the arguments; each of `int`, `float`, `bool` or
+            `object`. If given, the arguments are unboxed on entry and
+            values of these types are kept unboxed as `i64`, `double` and
+            `i1`, with native arithmetic and comparisons, until they are
+            passed to Python or returned. Native integers are 64-bit and
+            wrap on overflow. Division by zero raises ZeroDivisionError,
+            and arguments that do not fit raise the error of the unboxing
+            function (e.g. OverflowError).
+            Otherwise, every value is a Python object.
+    """
+    if opt not in range(4):
+        raise ValueError(f"opt must be 0 to 3, got {opt!r}")
     llvm.initialize()
     llvm.initialize_native_target()
     llvm.initialize_native_asmprinter()
 
-    mod = ir.Module()
-
-    # make function
     arity, bodynode = determine_arity(root)
     assert arity >= 1
     actual_num_args = arity - 1  # due to iostate
+    if argtypes is not None:
+        argtypes = tuple(argtypes)
+        if len(argtypes) != actual_num_args:
+            raise ValueError(
+                f"expected {actual_num_args} argtypes, got {len(argtypes)}"
+            )
+        for ty in argtypes:
+            if ty not in (int, float, bool, object):
+                raise ValueError(f"unsupported argument type: {ty!r}")
+    target = HostTarget.detect()
+    tm = target.create_target_machine(opt)
+    variant = f"O{opt}"
+    if argtypes is not None:
+        variant += ":" + ",".join(ty.__name__ for ty in argtypes)
+
+    def compile_module() -> llvm.ModuleRef:
+        llvm_ir = _emit_llvm_ir(bodynode, actual_num_args, argtypes)
+        return _optimize(llvm_ir, tm, opt, dump_ir)
+
+    lljit = llvm.create_lljit_compiler(tm)
+    builder = llvm.JITLibraryBuilder()
+    if cache is None:
+        builder.add_ir(compile_module())
+    else:
+        key = cache.key(root, target, variant)
+        objcode = cache.get(key)
+        if objcode is None:
+            objcode = tm.emit_object(compile_module())
+            cache.put(key, objcode)
+        builder.add_object_img(objcode)
+    # Python globals are referenced by symbol so that the code does not
+    # depend on the addresses of this process.
+    for symbol, obj in _find_globals(root).items():
+        builder.import_symbol(symbol, id(obj))
+    rt = builder.export_symbol("foo").add_current_process().link(lljit, "foo")
+    ptr = rt["foo"]
+    return JitCallable.from_pointer(rt, ptr, actual_num_args, argtypes)
+
+
+def _emit_llvm_ir(
+    bodynode: ase.SExpr,
+    actual_num_args: int,
+    argtypes: tuple[type, ...] | None = None,
+) -> str:
+    # The type of a loop variable is only known after its loop body is
+    # generated. Start from the type on loop entry and generate again with
+    # the widened types until they are stable.
+    loop_types: dict[tuple[ase.handle_type, int], ir.Type] = {}
+    while True:
+        before = dict(loop_types)
+        llvm_ir = _emit_llvm_ir_once(
+            bodynode, actual_num_args, argtypes, loop_types
+        )
+        if loop_types == before:
+            return llvm_ir
+
+
+def _emit_llvm_ir_once(
+    bodynode: ase.SExpr,
+    actual_num_args: int,
+    argtypes: tuple[type, ...] | None,
+    loop_types: dict[tuple[ase.handle_type, int], ir.Type],
+) -> str:
+    mod = ir.Module()
+
+    # make function
     fnty = ir.FunctionType(
         ll_pyobject_ptr, [ll_pyobject_ptr] * actual_num_args
     )
@@ -36,6 +138,31 @@ def llvm_codegen(root: ase.SExpr):
     builder = ir.IRBuilder(fn.append_basic_block())
     retval_slot = builder.alloca(ll_pyobject_ptr)
     builder.store(ll_pyobject_ptr(None), retval_slot)  # init retval to NULL
+    pyapi = PythonAPI(builder)
+    arg_values = list(fn.args)
+    if argtypes is not None:
+        # unbox the arguments; -1 with an error set means failure
+        for i, ty in enumerate(argtypes):
+            if ty is int:
+                val = pyapi.long_as_ssize_t(fn.args[i])
+                failed = builder.and_(
+                    builder.icmp_signed("==", val, val.type(-1)),
+                    pyapi.err_is_set(),
+                )
+            elif ty is float:
+                val = pyapi.float_as_double(fn.args[i])
+                failed = builder.and_(
+                    builder.fcmp_ordered("==", val, val.type(-1)),
+                    pyapi.err_is_set(),
+                )
+            elif ty is bool:
+                istrue = pyapi.object_istrue(fn.args[i])
+                val = builder.icmp_signed(">", istrue, istrue.type(0))
+                failed = builder.icmp_signed("<", istrue, istrue.type(0))
+            else:
+                continue
+            _return_null_if(builder, failed)
+            arg_values[i] = val
     bb_main = builder.append_basic_block()
     builder.branch(bb_main)
     builder.position_at_end(bb_main)
@@ -44,8 +171,11 @@ def llvm_codegen(root: ase.SExpr):
         llvm_module=mod,
         llvm_func=fn,
         builder=builder,
-        pyapi=PythonAPI(builder),
+        pyapi=pyapi,
         retval_slot=retval_slot,
+        arg_values=arg_values,
+        typed=argtypes is not None,
+        loop_types=loop_types,
     )
     for i in reversed(range(actual_num_args)):
         ctx.blam_stack.append(BLamArg(argidx=i))
@@ -56,36 +186,193 @@ def llvm_codegen(root: ase.SExpr):
     builder.ret(builder.load(retval_slot))
 
     llvm_ir = str(mod)
-    print(llvm_ir)
 
     # llmod = llvm.parse_assembly(llvm_ir)
     # llvm.view_dot_graph(llvm.get_function_cfg(llmod.get_function("foo")), view=True)
-    # Create JIT
-    lljit = llvm.create_lljit_compiler()
-    rt = (
-        llvm.JITLibraryBuilder()
-        .add_ir(llvm_ir)
-        .export_symbol("foo")
-        .add_current_process()
-        .link(lljit, "foo")
-    )
-    ptr = rt["foo"]
-    return JitCallable.from_pointer(rt, ptr, actual_num_args)
+    return llvm_ir
+
+
+def _optimize(
+    llvm_ir: str,
+    tm: llvm.TargetMachine,
+    opt: int,
+    dump_ir: str | os.PathLike | None,
+) -> llvm.ModuleRef:
+    llmod = llvm.parse_assembly(llvm_ir)
+    llmod.verify()
+    if opt > 0:
+        llmod.triple = tm.triple
+        llmod.data_layout = str(tm.target_data)
+        pm = llvm.create_module_pass_manager()
+        tm.add_analysis_passes(pm)
+        # At O1 and above this includes SROA (mem2reg) and instcombine;
+        # GVN is added from O2.
+        with llvm.create_pass_manager_builder() as pmb:
+            pmb.opt_level = opt
+            pmb.populate(pm)
+        pm.run(llmod)
+        llmod.verify()
+    if dump_ir is not None:
+        with open(dump_ir, "w") as fout:
+            fout.write("; before optimization\n")
+            fout.write(llvm_ir)
+            fout.write(f"\n; after optimization (O{opt})\n")
+            fout.write(str(llmod))
+    return llmod
+
+
+class HostTarget(NamedTuple):
+    """The target the JIT compiles for; part of the `JitCache` key."""
+
+    triple: str
+    cpu: str
+    features: str
+
+    @classmethod
+    def detect(cls) -> HostTarget:
+        return cls(
+            llvm.get_process_triple(),
+            llvm.get_host_cpu_name(),
+            llvm.get_host_cpu_features().flatten(),
+        )
+
+    def create_target_machine(self, opt: int = 2) -> llvm.TargetMachine:
+        target = llvm.Target.from_triple(self.triple)
+        return target.create_target_machine(
+            cpu=self.cpu, features=self.features, opt=opt, jit=True
+        )
+
+
+class JitCache:
+    """An on-disk cache of the object code made by `llvm_codegen`.
+
+    Entries are keyed by the structure of the lambda expression, the
+    `HostTarget`, a string describing the code generation options (e.g.
+    the optimization level), and the versions of sealir, llvmlite and LLVM.
+    They are stored in `directory` as `<sha256>.o`.
+
+    The total size of the entries is bounded by `max_bytes`. The least
+    recently used ones are removed first; use is tracked by the modification
+    time of the files, so it is shared by all processes using `directory`.
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike,
+        *,
+        max_bytes: int = 64 * 2**20,
+    ):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, root: ase.SExpr, target: HostTarget, variant: str) -> str:
+        tape, _ = root._tape.compact([root._handle], keep_metadata=False)
+        parts = [
+            tape.digest(),
+            *target,
+            variant,
+            *package_versions("llvmlite"),
+            ".".join(map(str, llvm.llvm_version_info)),
+        ]
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        """The object code stored under `key`, as returned by `key()`."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fin:
+                objcode = fin.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return objcode
+
+    def put(self, key: str, objcode: bytes) -> None:
+        """Store `objcode` under `key`, as returned by `key()`."""
+        os.makedirs(self._directory, exist_ok=True)
+        path = self._path(key)
+        with atomic_write(path) as tmppath:
+            with open(tmppath, "wb") as fout:
+                fout.write(objcode)
+        self._evict(keep=path)
+
+    def _evict(self, keep: str) -> None:
+        entries = []
+        total = 0
+        for entry in os.scandir(self._directory):
+            if not entry.name.endswith(".o"):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                # removed by another process
+                continue
+            entries.append((st.st_mtime, entry.path, st.st_size))
+            total += st.st_size
+        entries.sort()
+        for _, path, size in entries:
+            if total <= self._max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.o")
+
+
+def _global_symbol(name: str) -> str:
+    return f"sealir.global.{name}"
+
+
+def _find_globals(root: ase.SExpr) -> dict[str, Any]:
+    """Map the symbols of the Python globals used by `root` to the objects."""
+    tape = root._tape
+    out = {}
+    for handle in tape.find_by_head(
+        "Py_GlobalLoad", within=ase.reachable_set(root)
+    ):
+        [glbname] = ase.BasicSExpr(tape, handle)._args
+        out[_global_symbol(glbname)] = __builtins__[glbname]
+    return out
 
 
 @dataclass(frozen=True)
 class JitCallable:
     rt: llvm.ResourceTracker
     pyfunc: Callable
+    argtypes: tuple[type, ...] | None = None
+    """Argument types of a typed function; checked on every call."""
 
     @classmethod
     def from_pointer(
-        cls, rt: llvm.ResourceTracker, ptr: int, arity: int
+        cls,
+        rt: llvm.ResourceTracker,
+        ptr: int,
+        arity: int,
+        argtypes: tuple[type, ...] | None = None,
     ) -> Self:
         pyfunc = _ct.PYFUNCTYPE(_ct.py_object, *([_ct.py_object] * arity))(ptr)
-        return cls(rt=rt, pyfunc=pyfunc)
+        return cls(rt=rt, pyfunc=pyfunc, argtypes=argtypes)
 
     def __call__(self, *args: Any) -> Any:
+        if self.argtypes is not None:
+            for i, (ty, arg) in enumerate(zip(self.argtypes, args)):
+                # ints are accepted for floats, as in Python
+                ok = isinstance(arg, (int, float) if ty is float else ty)
+                if not ok:
+                    raise TypeError(
+                        f"argument {i} must be {ty.__name__}, "
+                        f"got {type(arg).__name__}"
+                    )
         return self.pyfunc(*args)
 
 
@@ -106,6 +393,9 @@ def _codegen_loop(expr: ase.BasicSExpr, state: CodegenState):
         assert isinstance(val, BLamIOArg), val
         return val
 
+    def box(val):
+        return _box(pyapi, val)
+
     match expr:
         case lam.Arg(int(debruijn)):
             sp = -debruijn - 1
@@ -114,7 +404,7 @@ def _codegen_loop(expr: ase.BasicSExpr, state: CodegenState):
                 case BLamIOArg():
                     return sv
                 case BLamArg(int(idx)):
-                    return builder.function.args[idx]
+                    return ctx.arg_values[idx]
                 case BLamValue(val=val):
                     return val
                 case _:
@@ -142,10 +432,7 @@ def _codegen_loop(expr: ase.BasicSExpr, state: CodegenState):
             orelse=br_false,
         ):
             condval = yield cond
-            # unpack pybool
-            condbit = builder.icmp_unsigned(
-                "!=", pyapi.int32(0), pyapi.object_istrue(condval)
-            )
+            condbit = _truth(pyapi, condval)
 
             bb_then = builder.append_basic_block("then")
             bb_else = builder.append_basic_block("else")
@@ -155,19 +442,39 @@ def _codegen_loop(expr: ase.BasicSExpr, state: CodegenState):
             # Then
             with builder.goto_block(bb_then):
                 value_then = yield br_true
-                builder.branch(bb_endif)
                 bb_then_end = builder.basic_block
             # Else
             with builder.goto_block(bb_else):
                 value_else = yield br_false
-                builder.branch(bb_endif)
                 bb_else_end = builder.basic_block
+            assert len(value_then) == len(value_else)
+            # Both sides must agree on the type of each value
+            slot_types = [
+                (
+                    None
+                    if isinstance(left, BLamIOArg)
+                    else _unify_types(left.type, right.type)
+                )
+                for left, right in zip(value_then, value_else, strict=True)
+            ]
+            incomings = []
+            for values, bb_end in [
+                (value_then, bb_then_end),
+                (value_else, bb_else_end),
+            ]:
+                builder.position_at_end(bb_end)
+                incomings.append(
+                    [
+                        v if ty is None else _coerce(pyapi, v, ty)
+                        for v, ty in zip(values, slot_types)
+                    ]
+                )
+                builder.branch(bb_endif)
             # EndIf
             builder.position_at_end(bb_endif)
-            assert len(value_then) == len(value_else)
             phis = []
-            for left, right in zip(value_then, value_else, strict=True):
-                if isinstance(left, BLamIOArg) or isinstance(right, BLamIOArg):
+            for left, right, ty in zip(*incomings, slot_types):
+                if ty is None:
                     # handle iostate
                     assert isinstance(left, BLamIOArg) and isinstance(
                         right, BLamIOArg
@@ -175,13 +482,21 @@ def _codegen_loop(expr: ase.BasicSExpr, state: CodegenState):
                     phis.append(left)
                 else:
                     # otherwise
-                    assert left.type == right.type
-                    phi = builder.phi(left.type)
+                    phi = builder.phi(ty)
                     phi.add_incoming(left, bb_then_end)
                     phi.add_incoming(right, bb_else_end)
                     phis.append(phi)
             return tuple(phis)
         case rvsdg.Scfg_While(body=loopblk):
+            loopback_pack = ctx.blam_stack[-1]
+            assert isinstance(loopback_pack, BLamValue)
+            # coerce the incoming values to the types of the loop variables
+            entry_vals = []
+            for i, var in enumerate(loopback_pack.val):
+                if not isinstance(var, BLamIOArg):
+                    ty = ctx.loop_types.get((expr._handle, i), var.type)
+                    var = _coerce(pyapi, var, _unify_types(var.type, ty))
+                entry_vals.append(var)
             bb_before = builder.basic_block
             bb_loopbody = builder.append_basic_block("loopbody")
             bb_endloop = builder.append_basic_block("endloop")
@@ -189,11 +504,9 @@ def _codegen_loop(expr: ase.BasicSExpr, state: CodegenState):
             # loop body
             builder.position_at_end(bb_loopbody)
             # setup phi nodes for loopback variables
-            loopback_pack = ctx.blam_stack[-1]
-            assert isinstance(loopback_pack, BLamValue)
             phis = []
             fixups = {}
-            for i, var in enumerate(loopback_pack.val):
+            for i, var in enumerate(entry_vals):
                 if isinstance(var, BLamIOArg):
                     # iostate
                     phis.append(var)
@@ -206,43 +519,41 @@ def _codegen_loop(expr: ase.BasicSExpr, state: CodegenState):
             # replace the top of stack
             ctx.blam_stack[-1] = replace(loopback_pack, val=tuple(phis))
             # generate body
-            loopout = yield loopblk
+            loopout = list((yield loopblk))
             # get loop condition
-            loopcond = builder.icmp_unsigned(
-                "!=", pyapi.int32(0), pyapi.object_istrue(loopout[0])
-            )
+            loopcond = _truth(pyapi, loopout[0])
             # fix up phis
             for i, phi in fixups.items():
+                ty = _unify_types(phi.type, loopout[i].type)
+                if ty != phi.type:
+                    # The variable is wider than on entry. This code is
+                    # discarded; see `_emit_llvm_ir`.
+                    ctx.loop_types[expr._handle, i] = ty
+                    loopout[i] = ir.Constant(phi.type, ir.Undefined)
+                else:
+                    loopout[i] = _coerce(pyapi, loopout[i], ty)
                 phi.add_incoming(loopout[i], builder.basic_block)
             # back jump
             builder.cbranch(loopcond, bb_loopbody, bb_endloop)
             # end loop
             builder.position_at_end(bb_endloop)
-            return loopout
+            return tuple(loopout)
 
         case rvsdg.Py_Undef():
             return ll_pyobject_ptr(None)
         case rvsdg.Py_None():
             return pyapi.make_none()
         case rvsdg.Py_Str(str(text)):
-            module = builder.module
-            encoded = bytearray(text.encode("utf-8") + b"\x00")
-            byte_string = ir.Constant(
-                ir.ArrayType(ll_byte, len(encoded)), encoded
-            )
-            unique_name = module.get_unique_name("const_string")
-            gv = ir.GlobalVariable(module, byte_string.type, unique_name)
-            gv.global_constant = True
-            gv.initializer = byte_string
-            gv.linkage = "internal"
-            return pyapi.string_from_string(builder.bitcast(gv, pyapi.cstring))
+            return pyapi.string_from_string(pyapi.make_cstring(text))
         case rvsdg.Py_Int(int(ival)):
             const = ir.Constant(pyapi.py_ssize_t, int(ival))
+            if ctx.typed:
+                return const
             return pyapi.long_from_ssize_t(const)
         case rvsdg.Py_Tuple(args):
             elems = []
             for arg in args:
-                elems.append((yield arg))
+                elems.append(box((yield arg)))
             return pyapi.tuple_pack(elems)
         case rvsdg.Py_UnaryOp(
             opname=str(opname),
@@ -252,6 +563,8 @@ def _codegen_loop(expr: ase.BasicSExpr, state: CodegenState):
             ioval = yield iostate
             val = yield val
             match opname:
+                case "not" if _is_native(val):
+                    retval = builder.not_(_truth(pyapi, val))
                 case "not":
                     retval = pyapi.bool_from_bool(pyapi.object_not(val))
                 case _:
@@ -261,6 +574,10 @@ def _codegen_loop(expr: ase.BasicSExpr, state: CodegenState):
             ioval = ensure_io((yield iostate))
             lhsval = yield lhs
             rhsval = yield rhs
+            retval = _native_binop(pyapi, op, lhsval, rhsval)
+            if retval is not None:
+                return ioval, retval
+            lhsval, rhsval = box(lhsval), box(rhsval)
             match op:
                 case "+":
                     retval = ctx.pyapi.number_add(lhsval, rhsval)
@@ -284,6 +601,10 @@ def _codegen_loop(expr: ase.BasicSExpr, state: CodegenState):
             ioval = ensure_io((yield iostate))
             lhsval = yield lhs
             rhsval = yield rhs
+            res = _native_binop(pyapi, op, lhsval, rhsval)
+            if res is not None:
+                return ioval, res
+            lhsval, rhsval = box(lhsval), box(rhsval)
             match op:
                 case "+":
                     res = ctx.pyapi.number_add(lhsval, rhsval, inplace=True)
@@ -303,6 +624,10 @@ def _codegen_loop(expr: ase.BasicSExpr, state: CodegenState):
             ioval = ensure_io((yield iostate))
             lhsval = yield lhs
             rhsval = yield rhs
+            res = _native_compare(builder, op, lhsval, rhsval)
+            if res is not None:
+                return ioval, res
+            lhsval, rhsval = box(lhsval), box(rhsval)
             match op:
                 case "<" | ">" | "!=" | "in":
                     res = pyapi.object_richcompare(lhsval, rhsval, op)
@@ -312,7 +637,7 @@ def _codegen_loop(expr: ase.BasicSExpr, state: CodegenState):
         case rvsdg.Return(iostate=iostate, retval=retval):
             ensure_io((yield iostate))
             retval = yield retval
-            builder.store(retval, ctx.retval_slot)
+            builder.store(box(retval), ctx.retval_slot)
         case rvsdg.Py_Call(
             iostate=iostate,
             callee=callee,
@@ -322,20 +647,236 @@ def _codegen_loop(expr: ase.BasicSExpr, state: CodegenState):
             callee = yield callee
             argvals = []
             for arg in args:
-                argvals.append((yield arg))
+                argvals.append(box((yield arg)))
             retval = pyapi.call_function_objargs(callee, argvals)
             return ioval, retval
         case rvsdg.Py_GlobalLoad(str(glbname)):
-            freezeobj = __builtins__[glbname]
-            ptr = pyapi.py_ssize_t(id(freezeobj))
-            obj = builder.inttoptr(
-                ptr, ll_pyobject_ptr, name=f"global.{glbname}"
-            )
-            return obj
+            # The address of the symbol is the object; see `_find_globals`
+            return _get_c_value(builder, ll_byte, _global_symbol(glbname))
         case _:
             raise NotImplementedError(ase.as_tuple(expr, depth=2))
 
 
+def _is_native(val: Any) -> bool:
+    return isinstance(val.type, (ir.IntType, ir.DoubleType))
+
+
+def _unify_types(lhs: ir.Type, rhs: ir.Type) -> ir.Type:
+    """The type that can hold values of both types.
+
+    Values of different types are boxed; e.g. merging `1` and `1.5` must
+    give back an `int` or a `float` as in Python.
+    """
+    return lhs if lhs == rhs else ll_pyobject_ptr
+
+
+def _coerce(pyapi: PythonAPI, val: ir.Value, ty: ir.Type) -> ir.Value:
+    if val.type == ty:
+        return val
+    assert ty == ll_pyobject_ptr, ty
+    return _box(pyapi, val)
+
+
+def _box(pyapi: PythonAPI, val: Any) -> Any:
+    """Turn a native value into a Python object."""
+    if isinstance(val, BLamIOArg) or not _is_native(val):
+        return val
+    if val.type == ll_bool:
+        return pyapi.bool_from_bool(val)
+    if val.type == ll_double:
+        return pyapi.float_from_double(val)
+    return pyapi.long_from_ssize_t(val)
+
+
+def _truth(pyapi: PythonAPI, val: ir.Value) -> ir.Value:
+    """The truth value of `val` as an `i1`."""
+    builder = pyapi.builder
+    if val.type == ll_bool:
+        return val
+    if val.type == ll_double:
+        # NaN is true
+        return builder.fcmp_unordered("!=", val, ll_double(0))
+    if _is_native(val):
+        return builder.icmp_signed("!=", val, val.type(0))
+    return builder.icmp_unsigned(
+        "!=", pyapi.int32(0), pyapi.object_istrue(val)
+    )
+
+
+def _native_operands(
+    builder: ir.IRBuilder, lhs: Any, rhs: Any, promote_to_float: bool
+) -> tuple[ir.Value, ir.Value] | None:
+    """Convert both operands to `i64`, or to `double` if either one is a
+    float or `promote_to_float`. None if either one is not native.
+    """
+    if isinstance(lhs, BLamIOArg) or isinstance(rhs, BLamIOArg):
+        return None
+    if not (_is_native(lhs) and _is_native(rhs)):
+        return None
+    if promote_to_float or ll_double in (lhs.type, rhs.type):
+        ty = ll_double
+    else:
+        ty = ll_i64
+    out = []
+    for val in (lhs, rhs):
+        if val.type != ty:
+            if ty == ll_double:
+                val = (
+                    builder.uitofp(val, ty)
+                    if val.type == ll_bool
+                    else builder.sitofp(val, ty)
+                )
+            else:
+                val = builder.zext(val, ty)
+        out.append(val)
+    return out[0], out[1]
+
+
+def _native_binop(
+    pyapi: PythonAPI, op: str, lhs: Any, rhs: Any
+) -> ir.Value | None:
+    """Native arithmetic; None if not applicable to these operands.
+
+    Division by zero sets ZeroDivisionError and returns NULL from the
+    function.
+    """
+    if op not in ("+", "-", "*", "/", "//"):
+        return None
+    builder = pyapi.builder
+    operands = _native_operands(builder, lhs, rhs, op == "/")
+    if operands is None:
+        return None
+    any_float = ll_double in (lhs.type, rhs.type)
+    lhs, rhs = operands
+    if op in ("/", "//"):
+        # same messages as Python
+        if op == "/":
+            msg = "float division by zero" if any_float else "division by zero"
+        elif any_float:
+            msg = "float floor division by zero"
+        else:
+            msg = "integer division or modulo by zero"
+        if lhs.type == ll_double:
+            is_zero = builder.fcmp_ordered("==", rhs, ll_double(0))
+        else:
+            is_zero = builder.icmp_signed("==", rhs, ll_i64(0))
+        with builder.if_then(is_zero, likely=False):
+            pyapi.err_set_string("PyExc_ZeroDivisionError", msg)
+            builder.ret(ll_pyobject_ptr(None))
+    if lhs.type == ll_double:
+        match op:
+            case "+":
+                return builder.fadd(lhs, rhs)
+            case "-":
+                return builder.fsub(lhs, rhs)
+            case "*":
+                return builder.fmul(lhs, rhs)
+            case "/":
+                return builder.fdiv(lhs, rhs)
+            case "//":
+                return _float_floordiv(builder, lhs, rhs)
+    match op:
+        case "+":
+            return builder.add(lhs, rhs)
+        case "-":
+            return builder.sub(lhs, rhs)
+        case "*":
+            return builder.mul(lhs, rhs)
+        case "//":
+            zero = ll_i64(0)
+            minus_one = ll_i64(-1)
+            # INT64_MIN // -1 traps in sdiv; x // -1 is -x, which wraps
+            # like other overflows
+            by_minus_one = builder.icmp_signed("==", rhs, minus_one)
+            divisor = builder.select(by_minus_one, ll_i64(1), rhs)
+            quot = builder.select(
+                by_minus_one,
+                builder.sub(zero, lhs),
+                builder.sdiv(lhs, divisor),
+            )
+            rem = builder.srem(lhs, divisor)
+            # round toward negative infinity like Python
+            signs_differ = builder.icmp_signed(
+                "!=",
+                builder.icmp_signed("<", rem, zero),
+                builder.icmp_signed("<", rhs, zero),
+            )
+            adjust = builder.and_(
+                builder.icmp_signed("!=", rem, zero), signs_differ
+            )
+            return builder.sub(quot, builder.zext(adjust, ll_i64))
+    raise AssertionError(op)
+
+
+def _float_floordiv(
+    builder: ir.IRBuilder, lhs: ir.Value, rhs: ir.Value
+) -> ir.Value:
+    """`lhs // rhs` on doubles, following CPython's `float_floor_div`.
+
+    `rhs` must not be zero.
+    """
+    module = builder.module
+    floor = module.declare_intrinsic("llvm.floor", [ll_double])
+    copysign = module.declare_intrinsic(
+        "llvm.copysign",
+        [ll_double],
+        ir.FunctionType(ll_double, [ll_double, ll_double]),
+    )
+    zero = ll_double(0)
+    one = ll_double(1)
+    # frem is C's fmod; the result has the sign of `lhs`
+    mod = builder.frem(lhs, rhs)
+    div = builder.fdiv(builder.fsub(lhs, mod), rhs)
+    # make the remainder have the sign of `rhs`
+    adjust = builder.and_(
+        builder.fcmp_unordered("!=", mod, zero),
+        builder.icmp_unsigned(
+            "!=",
+            builder.fcmp_ordered("<", rhs, zero),
+            builder.fcmp_ordered("<", mod, zero),
+        ),
+    )
+    div = builder.select(adjust, builder.fsub(div, one), div)
+    # snap the quotient to the nearest integer
+    floordiv = builder.call(floor, [div])
+    floordiv = builder.select(
+        builder.fcmp_ordered(">", builder.fsub(div, floordiv), ll_double(0.5)),
+        builder.fadd(floordiv, one),
+        floordiv,
+    )
+    # a zero quotient takes the sign of the true quotient
+    signed_zero = builder.call(copysign, [zero, builder.fdiv(lhs, rhs)])
+    return builder.select(
+        builder.fcmp_unordered("!=", div, zero), floordiv, signed_zero
+    )
+
+
+def _return_null_if(builder: ir.IRBuilder, cond: ir.Value) -> None:
+    """Return NULL from the function if `cond`; a Python error must be
+    set.
+    """
+    with builder.if_then(cond, likely=False):
+        builder.ret(ll_pyobject_ptr(None))
+
+
+def _native_compare(
+    builder: ir.IRBuilder, op: str, lhs: Any, rhs: Any
+) -> ir.Value | None:
+    """Native comparison giving an `i1`; None if not applicable."""
+    if op not in ("<", "<=", "==", "!=", ">", ">="):
+        return None
+    operands = _native_operands(builder, lhs, rhs, False)
+    if operands is None:
+        return None
+    lhs, rhs = operands
+    if lhs.type == ll_double:
+        if op == "!=":
+            # true for NaN like Python
+            return builder.fcmp_unordered(op, lhs, rhs)
+        return builder.fcmp_ordered(op, lhs, rhs)
+    return builder.icmp_signed(op, lhs, rhs)
+
+
 @dataclass(frozen=True)
 class BLamBase:
     pass
@@ -364,6 +905,14 @@ class CodegenCtx:
     builder: ir.IRBuilder
     pyapi: PythonAPI
     retval_slot: ir.Value
+    arg_values: list[ir.Value]
+    """Values of the arguments; unboxed if `typed`."""
+    typed: bool = False
+    """If true, literals are made as native values."""
+    loop_types: dict[tuple[ase.handle_type, int], ir.Type] = field(
+        default_factory=dict
+    )
+    """Types of loop variables wider than their type on loop entry."""
     blam_stack: list[BLamBase] = field(default_factory=list)
 
     @contextmanager
@@ -600,6 +1149,49 @@ class PythonAPI:
         fn = self._get_function(fnty, name=fname)
         return self.builder.call(fn, [string])
 
+    def long_as_ssize_t(self, obj):
+        fnty = ir.FunctionType(self.py_ssize_t, [self.pyobj])
+        fn = self._get_function(fnty, name="PyLong_AsSsize_t")
+        return self.builder.call(fn, [obj])
+
+    def float_as_double(self, obj):
+        fnty = ir.FunctionType(self.double, [self.pyobj])
+        fn = self._get_function(fnty, name="PyFloat_AsDouble")
+        return self.builder.call(fn, [obj])
+
+    def err_is_set(self):
+        """An `i1` that is true if a Python error is set."""
+        fnty = ir.FunctionType(self.pyobj, [])
+        fn = self._get_function(fnty, name="PyErr_Occurred")
+        return self.builder.icmp_unsigned(
+            "!=", self.builder.call(fn, []), self.pyobj(None)
+        )
+
+    def err_set_string(self, exctype, msg):
+        fnty = ir.FunctionType(ir.VoidType(), [self.pyobj, self.cstring])
+        fn = self._get_function(fnty, name="PyErr_SetString")
+        # the exception variables are `PyObject *`
+        exc = self.builder.load(
+            _get_c_value(self.builder, self.pyobj, exctype, dllimport=True)
+        )
+        self.builder.call(fn, [exc, self.make_cstring(msg)])
+
+    def make_cstring(self, text):
+        """A pointer to a constant, NUL-terminated UTF-8 copy of `text`."""
+        encoded = bytearray(text.encode("utf-8") + b"\x00")
+        byte_string = ir.Constant(ir.ArrayType(ll_byte, len(encoded)), encoded)
+        unique_name = self.module.get_unique_name("const_string")
+        gv = ir.GlobalVariable(self.module, byte_string.type, unique_name)
+        gv.global_constant = True
+        gv.initializer = byte_string
+        gv.linkage = "internal"
+        return self.builder.bitcast(gv, self.cstring)
+
+    def float_from_double(self, fval):
+        fnty = ir.FunctionType(self.pyobj, [self.double])
+        fn = self._get_function(fnty, name="PyFloat_FromDouble")
+        return self.builder.call(fn, [fval])
+
     def make_none(self):
         obj = self.borrow_none()
         self.incref(obj)
@@ -0,0 +1,380 @@
+"""Evaluate a lambda expression, as returned by `rvsdg.restructure_source`,
+over NumPy columns.
+
+Example::
+
+    lam_node = rvsdg.restructure_source(udt)
+    run = compile_batch(lam_node)
+    out = run(np.arange(10), 3)  # one row per element; scalars broadcast
+
+Values that depend on a column are 1-D arrays with one element per row.
+Values that do not are kept as Python objects. Arithmetic, comparisons and
+`not` on columns are NumPy ufunc calls, so they follow NumPy semantics
+(e.g. fixed-width integers) rather than Python's.
+
+Python tuples and lists are columns of objects, one per row.
+
+`Scfg_If` with a per-row condition is evaluated with masks: each branch
+only sees its rows and the results are merged. Loops and other operations
+that cannot be expressed on whole columns fall back to evaluating each row
+with `rvsdg.compile_lambda` semantics.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable, TypeAlias
+
+import numpy as np
+
+from sealir import ase, lam, rvsdg
+from sealir.rvsdg import (
+    EvalIO,
+    Py_BinOp,
+    Py_Call,
+    Py_Compare,
+    Py_GetAttr,
+    Py_GetItem,
+    Py_InplaceBinOp,
+    Py_List,
+    Py_Tuple,
+    Py_UnaryOp,
+    Scfg_If,
+    Scfg_While,
+    ensure_io,
+)
+
+SExpr: TypeAlias = ase.SExpr
+
+
+def compile_batch(
+    lam_node: SExpr, *, localscope: dict[str, Any] | None = None
+) -> Callable[..., Any]:
+    """Compile the lambda expression of a function into a callable that
+    evaluates it over many rows at once.
+
+    The returned callable takes the arguments of the function. Each one is
+    either a 1-D array-like, giving one value per row, or a scalar shared by
+    all rows. At least one argument must be an array and all arrays must
+    have the same length. The return value is an array with one element
+    per row.
+    """
+    compiler = _BatchCompiler(localscope if localscope is not None else {})
+    code = compiler.compile(lam_node)
+
+    def run(*args):
+        columns = []
+        size = None
+        for arg in args:
+            if np.ndim(arg) == 0:
+                columns.append(arg)
+                continue
+            col = np.asarray(arg)
+            if col.ndim != 1:
+                raise ValueError(f"expected a 1-D array, got {col.shape}")
+            if size is None:
+                size = len(col)
+            elif len(col) != size:
+                raise ValueError(
+                    f"columns have different lengths: {size} != {len(col)}"
+                )
+            columns.append(col)
+        if size is None:
+            raise ValueError("at least one argument must be an array")
+        frame = _BatchFrame([*reversed(columns), EvalIO()], {}, size)
+        ioval, retval = code(frame)
+        return _broadcast(retval, size)
+
+    return run
+
+
+class _BatchFrame(rvsdg.ClosureFrame):
+    """Evaluation state over a set of rows.
+
+    Like `rvsdg.ClosureFrame`, with the number of rows in `size`.
+    """
+
+    __slots__ = ("size",)
+
+    def __init__(
+        self, stack: list[Any], memo: dict[ase.handle_type, Any], size: int
+    ):
+        super().__init__(stack, memo)
+        self.size = size
+
+    def select(self, mask: np.ndarray) -> _BatchFrame:
+        """A frame for the rows where `mask` is true."""
+        return _BatchFrame(
+            [_take(v, mask) for v in self.stack],
+            {k: _take(v, mask) for k, v in self.memo.items()},
+            int(np.count_nonzero(mask)),
+        )
+
+    def row(self, i: int) -> rvsdg.ClosureFrame:
+        """A frame of `rvsdg.compile_lambda` for row `i`."""
+        return rvsdg.ClosureFrame([_item(v, i) for v in self.stack], {})
+
+
+_Code: TypeAlias = Callable[[_BatchFrame], Any]
+
+
+class _BatchCompiler(rvsdg.ClosureCompiler):
+    def __init__(self, localscope: dict[str, Any]):
+        super().__init__(localscope)
+        # for the parts that are evaluated row by row
+        self._scalar = rvsdg.ClosureCompiler(localscope)
+
+    def _compile_node(self, expr: SExpr) -> _Code:
+        compile = self.compile
+        match expr:
+            case lam.Unpack(idx=int(idx), tup=packed_expr):
+                packed = compile(packed_expr)
+
+                def unpack(frame):
+                    # a `lam.Pack` is a tuple; a column holds Python tuples
+                    return _map_rows(
+                        lambda tup: tup[idx], frame.size, packed(frame)
+                    )
+
+                return unpack
+            case Py_Tuple(args):
+                elems = tuple(map(compile, args))
+                return lambda frame: _map_rows(
+                    lambda *vals: vals,
+                    frame.size,
+                    *(elem(frame) for elem in elems),
+                )
+            case Scfg_If(test=cond, then=br_true, orelse=br_false):
+                return self._compile_if(
+                    compile(cond), compile(br_true), compile(br_false)
+                )
+            case Py_GetAttr(attr=str(attrname), iostate=iostate, value=value):
+                io, val = compile(iostate), compile(value)
+
+                def getattr_(frame):
+                    ioval = ensure_io(io(frame))
+                    return ioval, _map_rows(
+                        lambda v: getattr(v, attrname), frame.size, val(frame)
+                    )
+
+                return getattr_
+            case Py_GetItem(iostate=iostate, value=value, slice=index):
+                io, val, idx = compile(iostate), compile(value), compile(index)
+
+                def getitem(frame):
+                    ioval = ensure_io(io(frame))
+                    base_val = val(frame)
+                    return ioval, _map_rows(
+                        lambda b, i: b[i], frame.size, base_val, idx(frame)
+                    )
+
+                return getitem
+            case Py_UnaryOp(opname=str(opname), iostate=iostate, arg=val):
+                if opname != "not":
+                    raise NotImplementedError(opname)
+                io, operand = compile(iostate), compile(val)
+
+                def unaryop(frame):
+                    ioval = io(frame)
+                    value = operand(frame)
+                    if isinstance(value, np.ndarray):
+                        return ioval, np.logical_not(value.astype(bool))
+                    return ioval, not value
+
+                return unaryop
+            case (
+                Py_BinOp(opname=str(op), iostate=iostate, lhs=lhs, rhs=rhs)
+                | Py_Compare(opname=str(op), iostate=iostate, lhs=lhs, rhs=rhs)
+                | Py_InplaceBinOp(
+                    opname=str(op), iostate=iostate, lhs=lhs, rhs=rhs
+                )
+            ):
+                try:
+                    fn = rvsdg.binop_table[expr._head, op]
+                except KeyError:
+                    raise NotImplementedError(op)
+                ufunc = _ufunc_table.get((expr._head, op))
+                arith = expr._head != "Py_Compare"
+                io, left, right = compile(iostate), compile(lhs), compile(rhs)
+
+                def binop(frame):
+                    ioval = ensure_io(io(frame))
+                    lhsval = left(frame)
+                    rhsval = right(frame)
+                    if ufunc is not None and (
+                        _is_numeric_column(lhsval)
+                        or _is_numeric_column(rhsval)
+                    ):
+                        if arith:
+                            lhsval = _bool_as_int(lhsval)
+                            rhsval = _bool_as_int(rhsval)
+                        return ioval, ufunc(lhsval, rhsval)
+                    return ioval, _map_rows(fn, frame.size, lhsval, rhsval)
+
+                return binop
+            case Py_Call(iostate=iostate, callee=callee, args=args):
+                io, fn = compile(iostate), compile(callee)
+                argcodes = tuple(map(compile, args))
+
+                def call(frame):
+                    ioval = ensure_io(io(frame))
+                    func = fn(frame)
+                    argvals = [arg(frame) for arg in argcodes]
+                    if isinstance(func, np.ufunc):
+                        return ioval, func(*argvals)
+                    return ioval, _map_rows(func, frame.size, *argvals)
+
+                return call
+            case Scfg_While():
+                # Evaluated row by row. The result packs the loop variables.
+                scalar_code = self._scalar.compile(expr)
+                return self._compile_rowwise(
+                    lambda row: tuple(scalar_code(row))
+                )
+            case Py_List(args):
+                elems = tuple(map(compile, args))
+                return lambda frame: _map_rows(
+                    lambda *vals: list(vals),
+                    frame.size,
+                    *(elem(frame) for elem in elems),
+                )
+            case _:
+                # the same as evaluating a single row
+                return super()._compile_node(expr)
+
+    def _compile_if(self, test: _Code, then: _Code, orelse: _Code) -> _Code:
+        def branch(frame: _BatchFrame) -> Any:
+            condval = test(frame)
+            if not isinstance(condval, np.ndarray):
+                return then(frame) if condval else orelse(frame)
+            mask = condval.astype(bool)
+            if mask.all():
+                return then(frame)
+            if not mask.any():
+                return orelse(frame)
+            # Masked execution; each branch only sees its own rows
+            out_true = then(frame.select(mask))
+            out_false = orelse(frame.select(~mask))
+            return _merge(mask, out_true, out_false)
+
+        return branch
+
+    def _compile_rowwise(
+        self, scalar_code: Callable[[rvsdg.ClosureFrame], tuple[Any, ...]]
+    ) -> _Code:
+        def rowwise(frame: _BatchFrame) -> tuple[Any, ...]:
+            if not any(map(_has_column, frame.stack)):
+                return scalar_code(frame.row(0))
+            rows = [scalar_code(frame.row(i)) for i in range(frame.size)]
+            return tuple(map(_stack_values, zip(*rows, strict=True)))
+
+        return rowwise
+
+
+_ufunc_table: dict[tuple[str, str], np.ufunc] = {
+    ("Py_BinOp", "+"): np.add,
+    ("Py_BinOp", "-"): np.subtract,
+    ("Py_BinOp", "*"): np.multiply,
+    ("Py_BinOp", "/"): np.true_divide,
+    ("Py_BinOp", "//"): np.floor_divide,
+    # never in-place; the operands may be the caller's arrays
+    ("Py_InplaceBinOp", "+"): np.add,
+    ("Py_InplaceBinOp", "*"): np.multiply,
+    ("Py_Compare", "<"): np.less,
+    ("Py_Compare", ">"): np.greater,
+    ("Py_Compare", "!="): np.not_equal,
+}
+
+
+def _is_numeric_column(value: Any) -> bool:
+    return isinstance(value, np.ndarray) and value.dtype != object
+
+
+def _bool_as_int(value: Any) -> Any:
+    # Python arithmetic on bools is integer arithmetic; NumPy's is logical
+    if isinstance(value, np.ndarray) and value.dtype == np.bool_:
+        return value.astype(np.int64)
+    return value
+
+
+def _has_column(value: Any) -> bool:
+    if isinstance(value, tuple):
+        return any(map(_has_column, value))
+    return isinstance(value, np.ndarray)
+
+
+def _take(value: Any, mask: np.ndarray) -> Any:
+    """Select the rows of `value` where `mask` is true."""
+    if isinstance(value, tuple):
+        return tuple(_take(v, mask) for v in value)
+    if isinstance(value, np.ndarray):
+        return value[mask]
+    return value
+
+
+def _item(value: Any, i: int) -> Any:
+    """The value of row `i` as a Python object."""
+    if isinstance(value, tuple):
+        return tuple(_item(v, i) for v in value)
+    if isinstance(value, np.ndarray):
+        return value.item(i)
+    return value
+
+
+def _column(values: list[Any]) -> np.ndarray:
+    """Make a 1-D array from one Python value per row."""
+    try:
+        arr = np.array(values)
+    except (ValueError, OverflowError):
+        arr = None
+    if arr is None or arr.ndim != 1:
+        arr = np.empty(len(values), dtype=object)
+        arr[:] = values
+    return arr
+
+
+def _map_rows(fn: Callable[..., Any], size: int, *args: Any) -> Any:
+    """Apply `fn` to each row of `args`; once if none is a column."""
+    if not any(isinstance(arg, np.ndarray) for arg in args):
+        return fn(*args)
+    return _column([fn(*(_item(arg, i) for arg in args)) for i in range(size)])
+
+
+def _stack_values(values: tuple[Any, ...]) -> Any:
+    """Turn the per-row values of a variable into a column. IO states are
+    kept as they are.
+    """
+    first = values[0]
+    if isinstance(first, EvalIO):
+        return first
+    return _column(list(values))
+
+
+def _merge(mask: np.ndarray, out_true: Any, out_false: Any) -> Any:
+    """Combine the results of the two sides of a masked branch."""
+    if isinstance(out_true, tuple):
+        assert isinstance(out_false, tuple)
+        assert len(out_true) == len(out_false)
+        return tuple(
+            _merge(mask, t, f)
+            for t, f in zip(out_true, out_false, strict=True)
+        )
+    if isinstance(out_true, EvalIO):
+        return ensure_io(out_false)
+    try:
+        dtype = np.result_type(out_true, out_false)
+    except TypeError:
+        dtype = np.dtype(object)
+    if dtype.kind in "SU":
+        # avoid truncating strings to the width of one side
+        dtype = np.dtype(object)
+    out = np.empty(len(mask), dtype=dtype)
+    out[mask] = out_true
+    out[~mask] = out_false
+    return out
+
+
+def _broadcast(value: Any, size: int) -> np.ndarray:
+    """Make `value` a column of `size` rows."""
+    if isinstance(value, np.ndarray):
+        return value
+    return _column([value] * size)
@@ -0,0 +1,297 @@
+"""Declarative rewrites using `grammar.Rule` instances as patterns.
+
+Example::
+
+    x = Var("x")
+    rules = [PatternRule("add-zero", Add(lhs=Num(0), rhs=x), x)]
+    new_root, report = PatternRewriter(rules).apply(grm, root)
+"""
+
+from __future__ import annotations
+
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable
+
+from sealir import ase, grammar
+from sealir.rewriter import TreeRewriter
+
+
+@dataclass(frozen=True)
+class Var:
+    """A pattern variable.
+
+    Matches any value. Using the same name more than once in a pattern
+    requires all occurrences to be equal. In the vararg field of a pattern,
+    it matches the remaining arguments as a tuple.
+    """
+
+    name: str
+
+
+@dataclass(frozen=True)
+class PatternRule:
+    """Rewrites expressions matching `pattern` into `replacement`.
+
+    Attributes:
+        name:
+            Name used in the `PatternReport`.
+        pattern:
+            A `grammar.Rule` instance whose fields can be `Var`, nested
+            `grammar.Rule` patterns or literal tokens.
+        replacement:
+            A `Var`, a `grammar.Rule` template using the variables of the
+            pattern, or a callable taking the bindings as keyword arguments
+            and returning an `SExpr` or a `grammar.Rule`.
+        guard (optional):
+            A callable taking the bindings as keyword arguments. The rule
+            only fires if it returns true.
+    """
+
+    name: str
+    pattern: grammar.Rule
+    replacement: Var | grammar.Rule | Callable[..., Any]
+    guard: Callable[..., bool] | None = None
+
+
+@dataclass
+class PatternReport:
+    rule_names: tuple[str, ...]
+    fired: Counter[str] = field(default_factory=Counter)
+    """Number of times each rule fired."""
+    pass_times: list[float] = field(default_factory=list)
+    """Duration in seconds of each pass."""
+    converged: bool = False
+    """True if the last pass did not fire any rule."""
+
+    def unused(self) -> list[str]:
+        """Names of the rules that never fired."""
+        return [name for name in self.rule_names if not self.fired[name]]
+
+
+class PatternRewriter:
+    """Applies a set of `PatternRule` to a fixpoint.
+
+    Patterns are compiled once. Candidate rules for a node are found by its
+    head and number of arguments; nested patterns test head and arity before
+    anything else. When several rules match a node, the first declared one
+    fires.
+    """
+
+    def __init__(self, rules: Iterable[PatternRule]):
+        self._rules = tuple(rules)
+        self._index: dict[tuple[str, int | None], list[_Compiled]] = {}
+        for order, rule in enumerate(self._rules):
+            compiled = _Compiled(rule, _compile(rule.pattern), order)
+            key = compiled.matcher.head, compiled.matcher.arity
+            self._index.setdefault(key, []).append(compiled)
+        self._candidate_cache: dict[tuple[str, int], list[_Compiled]] = {}
+
+    def apply(
+        self,
+        grm: grammar.Grammar,
+        root: ase.SExpr,
+        *,
+        max_passes: int = 100,
+        save_history: bool = False,
+    ) -> tuple[ase.SExpr, PatternReport]:
+        """Rewrite `root` until no rule fires or `max_passes` is reached.
+
+        Each pass is a bottom-up rewrite where at most one rule fires per
+        node.
+
+        Args:
+            save_history (optional):
+                If true, write `.md.rewrite` metadata mapping each rewritten
+                node to its original, as `TreeRewriter` does.
+                Defaults to ``False``.
+
+        Returns the new root and the report.
+        """
+        report = PatternReport(tuple(r.name for r in self._rules))
+        for _ in range(max_passes):
+            ts = time.perf_counter()
+            rewrite = _PatternPass(self, grm, report)
+            rewrite.flag_save_history = save_history
+            ase.apply_bottomup(root, rewrite)
+            root = rewrite.memo[root]
+            report.pass_times.append(time.perf_counter() - ts)
+            if not rewrite.fired:
+                report.converged = True
+                break
+        return root, report
+
+    def _candidates(self, expr: ase.SExpr) -> list[_Compiled]:
+        key = expr._head, len(expr._args)
+        out = self._candidate_cache.get(key)
+        if out is None:
+            # rules with this exact arity and vararg rules, in declared order
+            out = sorted(
+                [
+                    *self._index.get(key, ()),
+                    *self._index.get((expr._head, None), ()),
+                ],
+                key=lambda compiled: compiled.order,
+            )
+            self._candidate_cache[key] = out
+        return out
+
+
+class _PatternPass(TreeRewriter[ase.SExpr]):
+    flag_save_history = False
+
+    def __init__(
+        self,
+        engine: PatternRewriter,
+        grm: grammar.Grammar,
+        report: PatternReport,
+    ):
+        super().__init__()
+        self._engine = engine
+        self._grm = grm
+        self._report = report
+        self.fired = 0
+
+    def rewrite_generic(
+        self, orig: ase.SExpr, args: tuple[Any, ...], updated: bool
+    ) -> ase.SExpr:
+        expr = super().rewrite_generic(orig, args, updated)
+        for compiled in self._engine._candidates(expr):
+            bindings: dict[str, ase.value_type] = {}
+            if not _match(compiled.matcher, expr, bindings):
+                continue
+            rule = compiled.rule
+            if rule.guard is not None and not rule.guard(**bindings):
+                continue
+            self.fired += 1
+            self._report.fired[rule.name] += 1
+            return _build(self._grm, rule.replacement, bindings)
+        return expr
+
+
+@dataclass(frozen=True)
+class _Matcher:
+    head: str
+    arity: int | None
+    """Number of arguments. None if `rest` takes the remaining ones."""
+    args: tuple[_Matcher | Var | ase.value_type, ...]
+    rest: Var | None
+
+
+@dataclass(frozen=True)
+class _Compiled:
+    rule: PatternRule
+    matcher: _Matcher
+    order: int
+    """Position of the rule in the list given to `PatternRewriter`."""
+
+
+def _compile(pattern: grammar.Rule) -> _Matcher:
+    if not _is_rule(pattern):
+        raise TypeError(f"pattern must be a grammar.Rule: {pattern!r}")
+    fields = type(pattern)._fields
+    args: list[_Matcher | Var | ase.value_type] = []
+    rest = None
+    for i, fd in enumerate(fields):
+        value = getattr(pattern, fd.name)
+        if fd.is_vararg():
+            assert i + 1 == len(fields)
+            if isinstance(value, Var):
+                rest = value
+            else:
+                args.extend(map(_compile_arg, value))
+        else:
+            args.append(_compile_arg(value))
+    arity = None if rest is not None else len(args)
+    return _Matcher(type(pattern)._sexpr_head, arity, tuple(args), rest)
+
+
+def _compile_arg(value: Any) -> _Matcher | Var | ase.value_type:
+    if _is_rule(value):
+        return _compile(value)
+    return value
+
+
+def _is_rule(value: Any) -> bool:
+    # Rule.__instancecheck__ compares heads for SExpr
+    return not isinstance(value, ase.SExpr) and isinstance(value, grammar.Rule)
+
+
+def _match(
+    matcher: _Matcher, expr: ase.SExpr, bindings: dict[str, ase.value_type]
+) -> bool:
+    if expr._head != matcher.head:
+        return False
+    values = expr._args
+    nargs = len(matcher.args)
+    if matcher.arity is None:
+        if len(values) < nargs:
+            return False
+    elif len(values) != nargs:
+        return False
+    # Check heads of nested patterns and literals before binding
+    for pat, val in zip(matcher.args, values):
+        match pat:
+            case _Matcher():
+                if not isinstance(val, ase.SExpr) or val._head != pat.head:
+                    return False
+            case Var():
+                pass
+            case ase.SExpr():
+                if val != pat:
+                    return False
+            case _:
+                if isinstance(val, ase.SExpr) or not _same_token(pat, val):
+                    return False
+    for pat, val in zip(matcher.args, values):
+        match pat:
+            case _Matcher():
+                assert isinstance(val, ase.SExpr)
+                if not _match(pat, val, bindings):
+                    return False
+            case Var():
+                if not _bind(bindings, pat, val):
+                    return False
+    if matcher.rest is not None:
+        if not _bind(bindings, matcher.rest, tuple(values[nargs:])):
+            return False
+    return True
+
+
+def _same_token(lhs: Any, rhs: Any) -> bool:
+    # the tape distinguishes `1`, `1.0` and `True`
+    return type(lhs) is type(rhs) and lhs == rhs
+
+
+def _bind(bindings: dict[str, Any], var: Var, value: Any) -> bool:
+    if var.name in bindings:
+        return bindings[var.name] == value
+    bindings[var.name] = value
+    return True
+
+
+def _build(
+    grm: grammar.Grammar,
+    template: Any,
+    bindings: dict[str, ase.value_type],
+) -> Any:
+    match template:
+        case Var(name):
+            return bindings[name]
+        case ase.SExpr():
+            return template
+        case _ if _is_rule(template):
+            kwargs = {}
+            for fd in type(template)._fields:
+                value = getattr(template, fd.name)
+                if fd.is_vararg() and not isinstance(value, Var):
+                    value = tuple(_build(grm, v, bindings) for v in value)
+                else:
+                    value = _build(grm, value, bindings)
+                kwargs[fd.name] = value
+            return grm.write(type(template)(**kwargs))
+        case _ if callable(template):
+            return _build(grm, template(**bindings), {})
+        case _:
+            return template
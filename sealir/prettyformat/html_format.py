@@ -23,9 +23,7 @@ def find_source_md(node: SExpr) -> SExpr | None:
 
 def to_html(root: SExpr) -> str:
 
-    reachable = {
-        node for _, node in ase.walk_descendants_depth_first_no_repeat(root)
-    }
+    reachable = ase.reachable_set(root)
 
     class ToHtml(TreeRewriter[str]):
 
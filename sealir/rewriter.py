@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 from collections import deque
-from typing import Any, Generic, NamedTuple, TypeVar, Union
+from collections.abc import MutableMapping
+from typing import Any, Callable, Generic, NamedTuple, TypeVar, Union
 
 from sealir import ase
 
@@ -56,12 +57,35 @@ def metadata_find_original(node: ase.SExpr, loc_test) -> ase.SExpr | None:
 
 class TreeRewriter(Generic[T], ase.TreeVisitor):
 
-    memo: dict[ase.SExpr, Union[T, ase.SExpr]]
+    memo: MutableMapping[ase.SExpr, Union[T, ase.SExpr]]
 
     flag_save_history = True
 
+    flag_memo_by_handle = False
+    """Use a `ase.HandleMemo` as the memo. The rewriter can then only be
+    applied to a single tape.
+    """
+
+    _rewrite_handlers: dict[str, Callable[..., Any] | None]
+    """Maps S-expression heads to the bound `rewrite_<head>` methods of this
+    rewriter, or None if there is none. Filled on the first use of a head.
+    """
+
     def __init__(self):
-        self.memo = {}
+        self.memo = ase.HandleMemo() if self.flag_memo_by_handle else {}
+        self._rewrite_handlers = {}
+
+    def _get_rewrite_handler(self, head: str) -> Callable[..., Any] | None:
+        handlers = self._rewrite_handlers
+        try:
+            return handlers[head]
+        except KeyError:
+            if head == "generic":
+                fn = None
+            else:
+                fn = getattr(self, f"rewrite_{head}", None)
+            handlers[head] = fn
+            return fn
 
     def visit(self, expr: ase.SExpr) -> None:
         if expr in self.memo:
@@ -84,30 +108,45 @@ class TreeRewriter(Generic[T], ase.TreeVisitor):
                 )
 
     def _dispatch(self, orig: ase.SExpr) -> T | ase.SExpr:
-        args = orig._args
+        # Resolve the arguments from the raw record so that no wrapper is
+        # made for children that are only used as memo keys.
+        tape = orig._tape
+        memo = self.memo
+        handle = orig._handle
+        by_handle = isinstance(memo, ase.HandleMemo)
         updated = False
-
-        def _lookup(val):
-            nonlocal updated
-            if isinstance(val, ase.SExpr):
+        args = []
+        for ref in tape._heap[handle + 2 : tape.record_end(handle)]:
+            if ref > 0:
                 updated = True
-                return self.memo[val]
+                try:
+                    if by_handle:
+                        args.append(memo.lookup_handle(ref))
+                    else:
+                        args.append(memo[ase.BasicSExpr(tape, ref)])
+                except KeyError:
+                    # metadata records are not visited; pass them as is
+                    child = ase.BasicSExpr(tape, ref)
+                    if not ase.is_metadata(child):
+                        raise
+                    args.append(child)
             else:
-                return val
+                args.append(tape._read_token(ref))
+        args = tuple(args)
 
-        args = tuple(_lookup(arg) for arg in args)
-
-        if updated:
-            self._passthru_state = lambda: orig._replace(*args)
-        else:
-            self._passthru_state = lambda: orig
+        # Only remember what is needed to make the passthru node on demand
+        self._passthru_orig = orig
+        self._passthru_args = args
+        self._passthru_updated = updated
 
-        res = self._default_rewrite_dispatcher(orig, updated, args)
-
-        return res
+        return self._default_rewrite_dispatcher(orig, updated, args)
 
     def passthru(self) -> ase.SExpr:
-        return self._passthru_state()
+        orig = self._passthru_orig
+        if self._passthru_updated:
+            return orig._replace(*self._passthru_args)
+        else:
+            return orig
 
     def rewrite_generic(
         self, orig: ase.SExpr, args: tuple[Any, ...], updated: bool
@@ -127,9 +166,67 @@ class TreeRewriter(Generic[T], ase.TreeVisitor):
         updated: bool,
         args: tuple[T | ase.value_type],
     ) -> T | ase.SExpr:
-        fname = f"rewrite_{orig._head}"
-        fn = getattr(self, fname, None)
+        fn = self._get_rewrite_handler(orig._head)
         if fn is not None:
             return fn(orig, *args)
         else:
             return self.rewrite_generic(orig, args, updated)
+
+
+class RewriteSession(Generic[T]):
+    """Applies a rewriter to successive roots of a growing tape.
+
+    The memo of the rewriter is kept across runs. Since the tape is
+    append-only, a memoized record never changes. Each run only visits the
+    records reachable from the root that are not yet memoized, which are
+    usually the records appended since the last run.
+    """
+
+    rewriter: TreeRewriter[T]
+    last_visited: int
+    """Number of records visited by the last `run()`. Metadata records are
+    never visited.
+    """
+
+    def __init__(self, rewriter: TreeRewriter[T]):
+        self.rewriter = rewriter
+        self.last_visited = 0
+        self._tape: ase.Tape | None = None
+
+    def run(self, root: ase.SExpr) -> T | ase.SExpr:
+        """Rewrite `root` and return its result."""
+        tape = root._tape
+        if self._tape is None:
+            self._tape = tape
+        elif self._tape is not tape:
+            raise ValueError("a RewriteSession is bound to a single tape")
+
+        memo = self.rewriter.memo
+        heap = tape._heap
+        # Find the records that are not memoized; stop at memoized ones.
+        # Metadata records are never memoized, so they are skipped here
+        # instead of being walked again on every run.
+        pending: list[ase.handle_type] = []
+        seen: set[ase.handle_type] = set()
+        stack = [root._handle]
+        while stack:
+            handle = stack.pop()
+            if handle in seen:
+                continue
+            seen.add(handle)
+            expr = ase.BasicSExpr(tape, handle)
+            if expr in memo or ase.is_metadata(expr):
+                continue
+            pending.append(handle)
+            for ref in heap[handle + 2 : tape.record_end(handle)]:
+                if ref > 0:
+                    stack.append(ref)
+
+        # Children are always before parents in the tape
+        pending.sort()
+        downcast = root._get_downcast()
+        visitor = self.rewriter
+        for handle in pending:
+            visitor.visit(downcast(ase.BasicSExpr(tape, handle)))
+        self.last_visited = len(pending)
+        return memo[root]
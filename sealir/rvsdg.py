@@ -1,17 +1,28 @@
 from __future__ import annotations
 
 import ast
+import hashlib
 import inspect
 import logging
 import operator
+import os
 import time
-from collections import ChainMap
+import tracemalloc
+from collections import ChainMap, Counter, OrderedDict
 from contextlib import contextmanager
 from dataclasses import dataclass, field
 from functools import reduce
 from pprint import pformat, pprint
 from textwrap import dedent
-from typing import Any, Iterable, Iterator, NamedTuple, Sequence, TypeAlias
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Sequence,
+    TypeAlias,
+)
 
 from numba_rvsdg.core.datastructures.ast_transforms import (
     AST2SCFGTransformer,
@@ -20,6 +31,7 @@ from numba_rvsdg.core.datastructures.ast_transforms import (
 )
 
 from sealir import ase, grammar, lam
+from sealir.cache_utils import atomic_write, package_versions
 from sealir.rewriter import TreeRewriter
 
 _logger = logging.getLogger(__name__)
@@ -343,13 +355,8 @@ def find_variable_info(expr: SExpr):
     stored: dict[str, SExpr] = {}
 
     def get_args(expr: SExpr) -> Iterator[str]:
-        _, first_def = next(
-            ase.search_descendants(
-                expr, lambda x: x._head == "PyAst_FunctionDef"
-            )
-        )
-        assert first_def == expr
-        (fname, args, block, loc) = expr._args
+        assert expr._head == "PyAst_FunctionDef"
+        fname, args, block, loc = expr._args
         for arg in args._args:
             match arg:
                 case ase.BasicSExpr("PyAst_arg", (name, *_)):
@@ -359,19 +366,21 @@ def find_variable_info(expr: SExpr):
 
     arguments = tuple(get_args(expr))
 
-    class FindVariableUse(ase.TreeVisitor):
-        def visit(self, expr: SExpr):
-            match expr:
-                case ase.BasicSExpr("PyAst_Name", (name, "load", loc)):
-                    loaded[name] = expr
-                case ase.BasicSExpr("PyAst_Name", (name, "store", loc)):
-                    stored[name] = expr
-                case ase.BasicSExpr("PyAst_arg", (name, anno, loc)):
-                    stored[name] = expr
-                case _ if expr._head in {"PyAst_Name", "PyAst_arg"}:
-                    raise AssertionError(expr)
-
-    ase.apply_bottomup(expr, FindVariableUse())
+    tape = expr._tape
+    reachable = ase.reachable_set(expr)
+    for handle in tape.find_by_head(
+        ("PyAst_Name", "PyAst_arg"), within=reachable
+    ):
+        node = ase.BasicSExpr(tape, handle)
+        match node:
+            case ase.BasicSExpr("PyAst_Name", (name, "load", loc)):
+                loaded[name] = node
+            case ase.BasicSExpr("PyAst_Name", (name, "store", loc)):
+                stored[name] = node
+            case ase.BasicSExpr("PyAst_arg", (name, anno, loc)):
+                stored[name] = node
+            case _:
+                raise AssertionError(node)
 
     nonlocals = set()
     for k in loaded:
@@ -560,6 +569,48 @@ class Grammar(grammar.Grammar):
     start = lam.LamGrammar.start | _Root
 
 
+def _uses_io(val: SExpr) -> bool:
+    """Test if `val` contains a `VarLoad(".io")`.
+
+    The result of every visited record is cached on the tape; 1 for no and 2
+    for yes. Records never change, so each is inspected once per tape.
+    """
+    tape = val._tape
+    heap = tape._heap
+    varload = tape._tokenmap.get((str, "VarLoad"))
+    io = tape._tokenmap.get((str, ".io"))
+    if varload is None or io is None:
+        return False
+
+    state = tape._caches.get(_uses_io)
+    if state is None:
+        state = tape._caches[_uses_io] = bytearray()
+    if len(state) < len(heap):
+        state.extend(bytes(len(heap) - len(state)))
+
+    # Iterative post-order so that children are decided first
+    stack = [val._handle]
+    while stack:
+        handle = stack[-1]
+        if state[handle]:
+            stack.pop()
+            continue
+        end = tape.record_end(handle)
+        refs = [ref for ref in heap[handle + 2 : end] if ref > 0]
+        pending = [ref for ref in refs if not state[ref]]
+        if pending:
+            stack.extend(pending)
+            continue
+        found = (
+            heap[handle + 1] == varload
+            and end == handle + 3
+            and heap[handle + 2] == io
+        ) or any(state[ref] == 2 for ref in refs)
+        state[handle] = 2 if found else 1
+        stack.pop()
+    return state[val._handle] == 2
+
+
 def convert_to_rvsdg(grm: Grammar, prgm: SExpr, varinfo: VariableInfo):
     tp = prgm._tape
 
@@ -570,17 +621,10 @@ def convert_to_rvsdg(grm: Grammar, prgm: SExpr, varinfo: VariableInfo):
             ase.search_parents(expr, lambda x: x._head == "PyAst_block")
         )
 
-    def uses_io(val: SExpr):
-        return any(
-            ase.search_descendants(
-                val, lambda x: x._head == "VarLoad" and x._args == (".io",)
-            )
-        )
-
     def unpack_tuple(
         val: SExpr, targets: Sequence[str], *, force_io=False
     ) -> Iterable[tuple[SExpr, str]]:
-        if (force_io or uses_io(val)) and ".io" not in targets:
+        if (force_io or _uses_io(val)) and ".io" not in targets:
             targets = (".io", *targets)
         if len(targets) == 1:
             yield (val, targets[0])
@@ -595,7 +639,7 @@ def convert_to_rvsdg(grm: Grammar, prgm: SExpr, varinfo: VariableInfo):
         val: SExpr, targets: Sequence[str], *, force_io=False
     ) -> Iterable[tuple[SExpr, str]]:
         assert len(targets) > 0
-        unpack_io = force_io or uses_io(val)
+        unpack_io = force_io or _uses_io(val)
         if unpack_io:
             packed_name = f".val.{val._handle}"
             for val, packed_name in unpack_tuple(
@@ -918,7 +962,7 @@ def convert_to_rvsdg(grm: Grammar, prgm: SExpr, varinfo: VariableInfo):
                         blk_true = replace_scfg_pass(blk_true, defs)
                         blk_false = replace_scfg_pass(blk_false, defs)
 
-                        if uses_io(test):
+                        if _uses_io(test):
                             [
                                 (unpack_cond, unpack_name),
                                 (io, iovar),
@@ -1135,7 +1179,7 @@ def convert_to_rvsdg(grm: Grammar, prgm: SExpr, varinfo: VariableInfo):
                         match p:
                             case Let(
                                 name=str(x), value=ase.SExpr() as defn
-                            ) if x == testname:
+                            ) if (x == testname):
                                 break
 
                     match defn:
@@ -1244,7 +1288,7 @@ def convert_to_lambda(prgm: SExpr, varinfo: VariableInfo):
     reachable = ase.reachable_set(prgm)
     ase.apply_bottomup(prgm, FindParentLet(), reachable=reachable)
 
-    _logger.debug("   var_load - let analysis", time.time() - ts)
+    _logger.debug("   var_load - let analysis: %.6fs", time.time() - ts)
 
     class RewriteToLambda(grammar.TreeRewriter[SExpr]):
         def rewrite_VarLoad(self, orig: SExpr, name: str) -> SExpr:
@@ -1275,55 +1319,216 @@ def convert_to_lambda(prgm: SExpr, varinfo: VariableInfo):
         rtl = RewriteToLambda()
         ase.apply_bottomup(prgm, rtl, reachable=reachable)
         memo = rtl.memo
-        _logger.debug("   rewrite_let_into_lambda", time.time() - ts)
+        _logger.debug("   rewrite_let_into_lambda: %.6fs", time.time() - ts)
         prgm = memo[prgm]
 
     return prgm  # lb.run_abstraction_pass(prgm)
 
 
-def restructure_source(function):
-    ast2scfg_transformer = AST2SCFGTransformer(function)
-    astcfg = ast2scfg_transformer.transform_to_ASTCFG()
-    scfg = astcfg.to_SCFG()
-    scfg.restructure()
-    scfg2ast = SCFG2ASTTransformer()
-    original_ast = unparse_code(function)[0]
-    transformed_ast = scfg2ast.transform(original=original_ast, scfg=scfg)
-
-    transformed_ast = ast.fix_missing_locations(transformed_ast)
-
-    srclines, firstline = inspect.getsourcelines(function)
-    firstline = 0
+class RestructureCache:
+    """A two-level cache of the results of `restructure_source`.
+
+    Entries are keyed by the source text and the qualified name of the
+    function, and by the versions of sealir and numba-rvsdg.
+    The in-process level keeps the most recently used `maxsize` lambda
+    tapes. The on-disk level, if `directory` is given, stores them with
+    `Tape.save()`.
+
+    Cached tapes only contain the records reachable from the lambda node;
+    the rewrite history metadata is dropped. Every lookup returns a node in
+    a fresh copy of the tape, so callers can keep appending to it.
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike | None = None,
+        *,
+        maxsize: int = 256,
+    ):
+        self._directory = directory
+        self._maxsize = maxsize
+        self._memory: OrderedDict[str, ase.Tape] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, function) -> str:
+        parts = [
+            inspect.getsource(function),
+            function.__qualname__,
+            *package_versions("numba-rvsdg"),
+        ]
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def get(self, function) -> SExpr | None:
+        key = self.key(function)
+        tape = self._memory.get(key)
+        if tape is not None:
+            self._memory.move_to_end(key)
+        elif self._directory is not None:
+            tape = self._load(key)
+        if tape is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._copy_out(tape)
+
+    def put(self, function, lam_node: SExpr) -> SExpr:
+        """Store `lam_node` and return it as `get()` would."""
+        key = self.key(function)
+        tape, _ = lam_node._tape.compact(
+            [lam_node._handle], keep_metadata=False
+        )
+        self._remember(key, tape)
+        if self._directory is not None:
+            os.makedirs(self._directory, exist_ok=True)
+            with atomic_write(self._path(key)) as tmppath:
+                tape.save(tmppath)
+        return self._copy_out(tape)
+
+    def _load(self, key: str) -> ase.Tape | None:
+        path = self._path(key)
+        try:
+            tape = ase.Tape.from_file(path)
+            tape.last()
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # A damaged entry is a miss. Remove it so that `put()` can
+            # replace it.
+            _logger.warning("dropping unreadable cache entry %s", path)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+        self._remember(key, tape)
+        return tape
+
+    @staticmethod
+    def _copy_out(tape: ase.Tape) -> SExpr:
+        copied, _ = tape.compact([tape.last()], keep_metadata=False)
+        return Grammar.downcast(ase.BasicSExpr(copied, copied.last()))
+
+    def _remember(self, key: str, tape: ase.Tape) -> None:
+        self._memory[key] = tape
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._maxsize:
+            self._memory.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        assert self._directory is not None
+        return os.path.join(self._directory, f"{key}.tape")
 
-    source_text = dedent("".join(srclines))
 
-    t_start = time.time()
+@dataclass(frozen=True)
+class StageStats:
+    name: str
+    seconds: float
+    """Wall time of the stage."""
+    heap_size_before: int
+    """Heap size of the tape at the start; 0 if there was no tape yet."""
+    heap_size_after: int
+    peak_memory: int | None
+    """Peak traced memory in bytes. None if memory is not traced."""
 
-    prgm = convert_to_sexpr(transformed_ast, firstline)
 
-    _logger.debug("convert_to_sexpr", time.time() - t_start)
+@dataclass
+class PipelineStats:
+    """Instrumentation of one `restructure_source` run."""
 
-    varinfo = find_variable_info(prgm)
-    _logger.debug(varinfo)
+    function: str
+    trace_memory: bool = False
+    stages: list[StageStats] = field(default_factory=list)
+    head_counts: Counter[str] = field(default_factory=Counter)
+    """Number of records per head in the final tape."""
 
-    _logger.debug("find_variable_info", time.time() - t_start)
+    @property
+    def total_seconds(self) -> float:
+        return sum(st.seconds for st in self.stages)
 
-    grm = Grammar(prgm._tape)
-    rvsdg = convert_to_rvsdg(grm, prgm, varinfo)
+    @contextmanager
+    def stage(self, name: str, tape: ase.Tape | None = None):
+        """Time the body as the stage `name`.
+
+        The body can set `.tape` on the yielded object if it creates the
+        tape.
+        """
+        recorder = _StageRecorder(tape)
+        before = tape.heap_size if tape is not None else 0
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        ts = time.perf_counter()
+        yield recorder
+        elapsed = time.perf_counter() - ts
+        peak = (
+            tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+        )
+        after = recorder.tape.heap_size if recorder.tape is not None else 0
+        self.stages.append(StageStats(name, elapsed, before, after, peak))
+        _logger.debug("%s: %s took %.6fs", self.function, name, elapsed)
+
+    def count_heads(self, tape: ase.Tape) -> None:
+        heap = tape._heap
+        tokens = tape._tokens
+        self.head_counts.update(
+            tokens[-heap[begin + 1]]
+            for begin in tape._record_starts[: len(tape)]
+        )
 
-    _logger.debug("convert_to_rvsdg", time.time() - t_start)
 
-    from sealir.prettyformat import html_format
+@dataclass
+class _StageRecorder:
+    tape: ase.Tape | None
+
+
+def restructure_source(
+    function,
+    *,
+    cache: RestructureCache | None = None,
+    stats_sink: Callable[[PipelineStats], None] | None = None,
+    trace_memory: bool = False,
+):
+    """Convert the Python function into a lambda expression.
+
+    Args:
+        cache (optional):
+            A `RestructureCache` to look up and store the result.
+        stats_sink (optional):
+            Called with the `PipelineStats` of the run. Not called if the
+            result came from `cache`.
+        trace_memory (optional):
+            Record the peak memory of each stage with `tracemalloc`.
+            Defaults to ``False``.
+    """
+    if cache is not None:
+        lam_node = cache.get(function)
+        if lam_node is None:
+            lam_node = restructure_source(
+                function, stats_sink=stats_sink, trace_memory=trace_memory
+            )
+            lam_node = cache.put(function, lam_node)
+        return lam_node
 
-    pp(rvsdg)
+    stats = PipelineStats(function.__qualname__, trace_memory=trace_memory)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        lam_node, rvsdg, source_text = _run_pipeline(function, stats)
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    if stats_sink is not None:
+        stats.count_heads(lam_node._tape)
+        stats_sink(stats)
 
-    lam_node = convert_to_lambda(rvsdg, varinfo)
-    _logger.debug("convert_to_lambda", time.time() - t_start)
     if _DEBUG:
         pp(lam_node)
         print(ase.pretty_str(lam_node))
 
     if _DEBUG_HTML:
+        from sealir.prettyformat import html_format
+
         # FIXME: This is currently slow due to inefficient metadata lookup.
         print("writing html...")
         ts = time.time()
@@ -1338,6 +1543,45 @@ def restructure_source(function):
     return lam_node
 
 
+def _run_pipeline(function, stats: PipelineStats):
+    with stats.stage("ast_to_scfg"):
+        ast2scfg_transformer = AST2SCFGTransformer(function)
+        astcfg = ast2scfg_transformer.transform_to_ASTCFG()
+        scfg = astcfg.to_SCFG()
+
+    with stats.stage("restructure"):
+        scfg.restructure()
+        scfg2ast = SCFG2ASTTransformer()
+        original_ast = unparse_code(function)[0]
+        transformed_ast = scfg2ast.transform(original=original_ast, scfg=scfg)
+        transformed_ast = ast.fix_missing_locations(transformed_ast)
+
+    srclines, firstline = inspect.getsourcelines(function)
+    firstline = 0
+
+    source_text = dedent("".join(srclines))
+
+    with stats.stage("convert_to_sexpr") as stage:
+        prgm = convert_to_sexpr(transformed_ast, firstline)
+        stage.tape = prgm._tape
+
+    tape = prgm._tape
+    with stats.stage("find_variable_info", tape):
+        varinfo = find_variable_info(prgm)
+    _logger.debug(varinfo)
+
+    with stats.stage("convert_to_rvsdg", tape):
+        grm = Grammar(tape)
+        rvsdg = convert_to_rvsdg(grm, prgm, varinfo)
+
+    pp(rvsdg)
+
+    with stats.stage("convert_to_lambda", tape):
+        lam_node = convert_to_lambda(rvsdg, varinfo)
+
+    return lam_node, rvsdg, source_text
+
+
 ######################
 
 
@@ -1400,6 +1644,24 @@ def ensure_io(obj: Any) -> EvalIO:
     return obj
 
 
+binop_table: dict[tuple[str, str], Callable[[Any, Any], Any]] = {
+    ("Py_BinOp", "+"): operator.add,
+    ("Py_BinOp", "-"): operator.sub,
+    ("Py_BinOp", "*"): operator.mul,
+    ("Py_BinOp", "/"): operator.truediv,
+    ("Py_BinOp", "//"): operator.floordiv,
+    ("Py_InplaceBinOp", "+"): operator.iadd,
+    ("Py_InplaceBinOp", "*"): operator.imul,
+    ("Py_Compare", "<"): operator.lt,
+    ("Py_Compare", ">"): operator.gt,
+    ("Py_Compare", "!="): operator.ne,
+    ("Py_Compare", "in"): lambda lhs, rhs: lhs in rhs,
+}
+"""Implementations of the binary operations, keyed by the head of the
+node and the operator name. Shared by the evaluators of lambda IR.
+"""
+
+
 def lambda_evaluation(expr: ase.BasicSExpr, state: EvalLamState):
     DEBUG = _DEBUG
 
@@ -1418,7 +1680,8 @@ def lambda_evaluation(expr: ase.BasicSExpr, state: EvalLamState):
         dbg_only = lambda f: lambda *args, **kwargs: None
 
     try:
-        dbg_print(" " * indent, "EVAL", expr._handle, repr(expr))
+        if DEBUG:
+            dbg_print(" " * indent, "EVAL", expr._handle, repr(expr))
         match expr:
             case lam.Lam(body):
                 retval = yield body
@@ -1456,17 +1719,7 @@ def lambda_evaluation(expr: ase.BasicSExpr, state: EvalLamState):
                     retval = yield br_false
                 return retval
             case Scfg_While(body=loopblk):
-                loop_cond = True
-                while loop_cond:
-                    memo = ase.traverse(loopblk, lambda_evaluation, state)
-                    loop_end_vars = memo[loopblk]
-                    # Update the loop condition (MUST BE FIRST ITEM)
-                    loop_cond = loop_end_vars[0]
-                    # Replace the top of stack with the out going value of the loop body
-                    ctx.blam_stack[-1] = ctx.blam_stack[-1]._replace(
-                        value=loop_end_vars
-                    )
-                return loop_end_vars
+                return _run_loop(loopblk, state)
             case Return(iostate=iostate, retval=retval):
                 ioval = ensure_io((yield iostate))
                 retval = yield retval
@@ -1523,68 +1776,22 @@ def lambda_evaluation(expr: ase.BasicSExpr, state: EvalLamState):
                     case _:
                         raise NotImplementedError(opname)
                 return ioval, retval
-            case Py_BinOp(
-                opname=str(op),
-                iostate=iostate,
-                lhs=lhs,
-                rhs=rhs,
+            case (
+                Py_BinOp(opname=str(op), iostate=iostate, lhs=lhs, rhs=rhs)
+                | Py_Compare(opname=str(op), iostate=iostate, lhs=lhs, rhs=rhs)
+                | Py_InplaceBinOp(
+                    opname=str(op), iostate=iostate, lhs=lhs, rhs=rhs
+                )
             ):
+                try:
+                    fn = binop_table[expr._head, op]
+                except KeyError:
+                    raise NotImplementedError(op)
                 ioval = ensure_io((yield iostate))
                 lhsval = yield lhs
                 rhsval = yield rhs
-                match op:
-                    case "+":
-                        retval = lhsval + rhsval
-                    case "-":
-                        retval = lhsval - rhsval
-                    case "*":
-                        retval = lhsval * rhsval
-                    case "/":
-                        retval = lhsval / rhsval
-                    case "//":
-                        retval = lhsval // rhsval
-                    case _:
-                        raise NotImplementedError(op)
+                retval = fn(lhsval, rhsval)
                 return ioval, retval
-            case Py_InplaceBinOp(
-                opname=str(op),
-                iostate=iostate,
-                lhs=lhs,
-                rhs=rhs,
-            ):
-                ioval = ensure_io((yield iostate))
-                lhsval = yield lhs
-                rhsval = yield rhs
-                match op:
-                    case "+":
-                        lhsval += rhsval
-                    case "*":
-                        lhsval *= rhsval
-                    case _:
-                        raise NotImplementedError(op)
-                retval = ioval, lhsval
-                return retval
-            case Py_Compare(
-                opname=str(op),
-                iostate=iostate,
-                lhs=lhs,
-                rhs=rhs,
-            ):
-                ioval = ensure_io((yield iostate))
-                lhsval = yield lhs
-                rhsval = yield rhs
-                match op:
-                    case "<":
-                        res = lhsval < rhsval
-                    case ">":
-                        res = lhsval > rhsval
-                    case "!=":
-                        res = lhsval != rhsval
-                    case "in":
-                        res = lhsval in rhsval
-                    case _:
-                        raise NotImplementedError(op)
-                return ioval, res
             case Py_Call(
                 iostate=iostate,
                 callee=callee,
@@ -1602,5 +1809,404 @@ def lambda_evaluation(expr: ase.BasicSExpr, state: EvalLamState):
             case _:
                 raise AssertionError(ase.as_tuple(expr))
     finally:
-        if "retval" in locals():
+        if DEBUG and "retval" in locals():
             dbg_print(" " * indent, f"({expr._handle})=>", retval)
+
+
+_STEP_EVAL, _STEP_BIND, _STEP_UNBIND = range(3)
+"""Kinds of the steps of a `_LoopSchedule`:
+
+- ``_STEP_EVAL``: evaluate the node.
+- ``_STEP_BIND``: push the value of the argument of the `lam.App` node.
+- ``_STEP_UNBIND``: pop that value; the `lam.App` node evaluates to its
+  `lam.Lam`.
+"""
+
+
+class _LoopSchedule(NamedTuple):
+    """Evaluation order of a loop body for `lambda_evaluation`.
+
+    Only handles are stored so that caching a schedule on the tape does not
+    keep expressions, and thus the tape, alive.
+    """
+
+    invariant: tuple[ase.handle_type, ...]
+    """Nodes that do not depend on the loop variables. Evaluated once."""
+    steps: tuple[tuple[int, ase.handle_type], ...]
+    """Remaining steps in post-order. Replayed at every iteration."""
+
+
+_loop_invariant_types = (
+    Py_Int,
+    Py_Complex,
+    Py_Str,
+    Py_None,
+    Py_Undef,
+    Py_GlobalLoad,
+    Py_Tuple,
+    BindArg,
+    lam.Pack,
+    lam.Unpack,
+)
+
+
+def _loop_schedule(loopblk: SExpr) -> _LoopSchedule:
+    """Compute the schedule of a loop body; cached on the tape by handle.
+
+    Only nodes that `lambda_evaluation` always evaluates are scheduled,
+    including the bodies of `lam.App`, which are bracketed by bind and
+    unbind steps. The branches of `Scfg_If` and the body of a nested
+    `Scfg_While` depend on runtime values, so they are left to be
+    traversed when their parent asks for them.
+    """
+    tape = loopblk._tape
+    cache = tape._caches.setdefault(_loop_schedule, {})
+    schedule = cache.get(loopblk._handle)
+    if schedule is not None:
+        return schedule
+
+    def eager_children(expr: SExpr) -> tuple[SExpr, ...]:
+        match expr:
+            case Scfg_If(test=cond):
+                return (cond,)
+            case Scfg_While():
+                return ()
+            case _:
+                return tuple(x for x in expr._args if isinstance(x, SExpr))
+
+    variant: dict[ase.handle_type, bool] = {}
+    invariant: list[ase.handle_type] = []
+    steps: list[tuple[int, ase.handle_type]] = []
+    # Iterative post-order so that children are scheduled first. Each item
+    # is a step kind and a node; `None` means the node is not expanded yet.
+    stack: list[tuple[int | None, SExpr]] = [(None, loopblk)]
+    while stack:
+        kind, expr = stack.pop()
+        handle = expr._handle
+        if kind is None:
+            if handle in variant:
+                continue
+            # Mark now. The expression is acyclic, so the node is only
+            # reached again after it is scheduled.
+            variant[handle] = True
+            match expr:
+                case lam.App(arg=argval, lam=lam_func):
+                    stack.append((_STEP_UNBIND, expr))
+                    stack.append((None, lam_func))
+                    stack.append((_STEP_BIND, expr))
+                    stack.append((None, argval))
+                case _:
+                    stack.append((_STEP_EVAL, expr))
+                    stack.extend(
+                        (None, child)
+                        for child in reversed(eager_children(expr))
+                    )
+        elif kind == _STEP_EVAL:
+            is_variant = not isinstance(expr, _loop_invariant_types) or any(
+                variant[child._handle] for child in eager_children(expr)
+            )
+            variant[handle] = is_variant
+            if is_variant:
+                steps.append((kind, handle))
+            else:
+                invariant.append(handle)
+        else:
+            steps.append((kind, handle))
+
+    schedule = cache[loopblk._handle] = _LoopSchedule(
+        tuple(invariant), tuple(steps)
+    )
+    return schedule
+
+
+def _run_loop(loopblk: SExpr, state: EvalLamState) -> Any:
+    """Evaluate a `Scfg_While` with body `loopblk` by replaying its
+    schedule at every iteration.
+    """
+    ctx = state.context
+    schedule = _loop_schedule(loopblk)
+    tape = loopblk._tape
+    downcast = loopblk._get_downcast()
+
+    def get(handle: ase.handle_type) -> SExpr:
+        return downcast(ase.BasicSExpr(tape, handle))
+
+    hoisted: dict[SExpr, Any] = {}
+    for handle in schedule.invariant:
+        _run_scheduled(get(handle), state, hoisted)
+    # Resolve the operands of the steps once per loop, not per iteration
+    steps: list[tuple[int, SExpr, SExpr | None]] = []
+    for kind, handle in schedule.steps:
+        node = get(handle)
+        if kind == _STEP_EVAL:
+            steps.append((kind, node, None))
+        elif kind == _STEP_BIND:
+            steps.append((kind, node.lam, node.arg))
+        else:
+            steps.append((kind, node, node.lam))
+
+    blam_stack = ctx.blam_stack
+    depth = len(blam_stack)
+    loop_cond = True
+    try:
+        while loop_cond:
+            memo = hoisted.copy()
+            for kind, node, operand in steps:
+                if kind == _STEP_EVAL:
+                    if node not in memo:
+                        _run_scheduled(node, state, memo)
+                elif kind == _STEP_BIND:
+                    blam_stack.append(SExprValuePair(node, memo[operand]))
+                else:
+                    blam_stack.pop()
+                    if node not in memo:
+                        memo[node] = memo[operand]
+            loop_end_vars = memo[loopblk]
+            # Update the loop condition (MUST BE FIRST ITEM)
+            loop_cond = loop_end_vars[0]
+            # Replace the top of stack with the out going value of the loop body
+            blam_stack[-1] = blam_stack[-1]._replace(value=loop_end_vars)
+    finally:
+        # drop the bindings left by an exception
+        del blam_stack[depth:]
+    return loop_end_vars
+
+
+def _run_scheduled(
+    expr: SExpr, state: EvalLamState, memo: dict[SExpr, Any]
+) -> None:
+    """Evaluate `expr` with `lambda_evaluation`, taking the values of its
+    children from `memo`. Children that are not there yet are traversed.
+    """
+    coro = lambda_evaluation(expr, state)
+    value = None
+    while True:
+        try:
+            item = coro.send(value)
+        except StopIteration as stopped:
+            memo[expr] = stopped.value
+            return
+        if item not in memo:
+            ase.traverse(item, lambda_evaluation, state, memo=memo)
+        value = memo[item]
+
+
+def compile_lambda(
+    lam_node: SExpr, *, localscope: dict[str, Any] | None = None
+) -> Callable[..., Any]:
+    """Compile the lambda expression of a function, as returned by
+    `restructure_source`, into a tree of Python closures.
+
+    The returned callable takes the arguments of the function and returns
+    its return value. It can be called many times while the expression is
+    only inspected once. Evaluation follows `lambda_evaluation`; i.e. each
+    node is evaluated at most once per call, and once per iteration inside
+    a loop body.
+    """
+    compiler = ClosureCompiler(localscope if localscope is not None else {})
+    code = compiler.compile(lam_node)
+
+    def run(*args):
+        frame = ClosureFrame([*reversed(args), EvalIO()], {})
+        ioval, retval = code(frame)
+        return retval
+
+    return run
+
+
+class ClosureFrame:
+    """Evaluation state of a compiled lambda.
+
+    `stack` holds the values bound by `App`; `Arg(i)` reads `stack[-i - 1]`.
+    `memo` maps handles to the values computed in this frame.
+    """
+
+    __slots__ = ("stack", "memo")
+
+    def __init__(self, stack: list[Any], memo: dict[ase.handle_type, Any]):
+        self.stack = stack
+        self.memo = memo
+
+
+_Code: TypeAlias = Callable[[ClosureFrame], Any]
+
+
+class ClosureCompiler:
+    """Compile lambda IR into Python closures that take a `ClosureFrame`.
+
+    Subclasses can evaluate nodes differently by overriding
+    `_compile_node`. `compile()` and the handling of `App`/`Lam` chains only
+    use the `stack` and `memo` of the frame.
+    """
+
+    def __init__(self, localscope: dict[str, Any]):
+        self._localscope = localscope
+        self._compiled: dict[ase.handle_type, _Code] = {}
+
+    def compile(self, expr: SExpr) -> _Code:
+        handle = expr._handle
+        code = self._compiled.get(handle)
+        if code is None:
+            impl = self._compile_node(expr)
+
+            def code(frame: ClosureFrame) -> Any:
+                memo = frame.memo
+                try:
+                    return memo[handle]
+                except KeyError:
+                    out = memo[handle] = impl(frame)
+                    return out
+
+            self._compiled[handle] = code
+        return code
+
+    def _compile_node(self, expr: SExpr) -> _Code:
+        compile = self.compile
+        match expr:
+            case lam.Lam() | lam.App():
+                return self._compile_chain(expr)
+            case lam.Arg(int(argidx)):
+                offset = -argidx - 1
+                return lambda frame: frame.stack[offset]
+            case lam.Unpack(idx=int(idx), tup=packed_expr):
+                packed = compile(packed_expr)
+                return lambda frame: packed(frame)[idx]
+            case lam.Pack(args) | Py_Tuple(args):
+                elems = tuple(map(compile, args))
+                return lambda frame: tuple(elem(frame) for elem in elems)
+            case Py_List(args):
+                elems = tuple(map(compile, args))
+                return lambda frame: [elem(frame) for elem in elems]
+            case Scfg_If(test=cond, then=br_true, orelse=br_false):
+                test = compile(cond)
+                then, orelse = compile(br_true), compile(br_false)
+                return lambda frame: (
+                    then(frame) if test(frame) else orelse(frame)
+                )
+            case Scfg_While(body=loopblk):
+                return self._compile_loop(compile(loopblk))
+            case Return(iostate=iostate, retval=retval):
+                io, ret = compile(iostate), compile(retval)
+                return lambda frame: (ensure_io(io(frame)), ret(frame))
+            case Py_Pass():
+                return lambda frame: None
+            case Py_Undef():
+                return lambda frame: EvalUndef()
+            case Py_None():
+                return lambda frame: None
+            case Py_Int(int(ival)):
+                return lambda frame: ival
+            case Py_Complex(real=float(freal), imag=float(fimag)):
+                cval = complex(freal, fimag)
+                return lambda frame: cval
+            case Py_Str(str(text)):
+                return lambda frame: text
+            case Py_GetAttr(attr=str(attrname), iostate=iostate, value=value):
+                io, val = compile(iostate), compile(value)
+                return lambda frame: (
+                    ensure_io(io(frame)),
+                    getattr(val(frame), attrname),
+                )
+            case Py_GetItem(iostate=iostate, value=value, slice=index):
+                io, val, idx = compile(iostate), compile(value), compile(index)
+
+                def getitem(frame):
+                    ioval = ensure_io(io(frame))
+                    base_val = val(frame)
+                    return ioval, base_val[idx(frame)]
+
+                return getitem
+            case Py_UnaryOp(opname=str(opname), iostate=iostate, arg=val):
+                if opname != "not":
+                    raise NotImplementedError(opname)
+                io, operand = compile(iostate), compile(val)
+
+                def unaryop(frame):
+                    ioval = io(frame)
+                    return ioval, not operand(frame)
+
+                return unaryop
+            case (
+                Py_BinOp(opname=str(op), iostate=iostate, lhs=lhs, rhs=rhs)
+                | Py_Compare(opname=str(op), iostate=iostate, lhs=lhs, rhs=rhs)
+                | Py_InplaceBinOp(
+                    opname=str(op), iostate=iostate, lhs=lhs, rhs=rhs
+                )
+            ):
+                try:
+                    fn = binop_table[expr._head, op]
+                except KeyError:
+                    raise NotImplementedError(op)
+                io, left, right = compile(iostate), compile(lhs), compile(rhs)
+
+                def binop(frame):
+                    ioval = ensure_io(io(frame))
+                    lhsval = left(frame)
+                    return ioval, fn(lhsval, right(frame))
+
+                return binop
+            case Py_Call(iostate=iostate, callee=callee, args=args):
+                io, fn = compile(iostate), compile(callee)
+                argcodes = tuple(map(compile, args))
+
+                def call(frame):
+                    ioval = ensure_io(io(frame))
+                    func = fn(frame)
+                    argvals = [arg(frame) for arg in argcodes]
+                    return ioval, func(*argvals)
+
+                return call
+            case Py_GlobalLoad(str(glbname)):
+                scope = ChainMap(self._localscope, __builtins__)
+                return lambda frame: scope[glbname]
+            case _:
+                raise NotImplementedError(ase.as_tuple(expr))
+
+    def _compile_chain(self, expr: SExpr) -> _Code:
+        # Flatten nested `App`/`Lam` into a sequence of bindings so that
+        # the Python stack does not grow with the number of let-bindings.
+        args: list[_Code] = []
+        chain: list[ase.handle_type] = []
+        while True:
+            match expr:
+                case lam.App(arg=argval, lam=lam_func):
+                    args.append(self.compile(argval))
+                    expr = lam_func
+                case lam.Lam(body):
+                    expr = body
+                case _:
+                    break
+            chain.append(expr._handle)
+        body = self.compile(expr)
+        nargs = len(args)
+        # the nested nodes evaluate to the same value as the whole chain
+        inner = tuple(chain[:-1])
+
+        def run_chain(frame: ClosureFrame) -> Any:
+            stack = frame.stack
+            for arg in args:
+                stack.append(arg(frame))
+            try:
+                out = body(frame)
+            finally:
+                del stack[len(stack) - nargs :]
+            memo = frame.memo
+            for handle in inner:
+                memo[handle] = out
+            return out
+
+        return run_chain
+
+    def _compile_loop(self, body: _Code) -> _Code:
+        def loop(frame: ClosureFrame) -> Any:
+            stack = frame.stack
+            while True:
+                # each iteration sees fresh values
+                loop_end_vars = body(ClosureFrame(stack, {}))
+                # Replace the top of stack with the out going value
+                stack[-1] = loop_end_vars
+                # Update the loop condition (MUST BE FIRST ITEM)
+                if not loop_end_vars[0]:
+                    return loop_end_vars
+
+        return loop
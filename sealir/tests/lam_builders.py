@@ -0,0 +1,90 @@
+"""Hand-built lambda IR for tests that should not depend on the frontend."""
+
+from sealir import lam
+from sealir.rvsdg import (
+    Py_BinOp,
+    Py_Compare,
+    Py_Int,
+    Py_Tuple,
+    Return,
+    Scfg_While,
+)
+
+
+def build_counting_loop(grm):
+    # Sums the numbers below n:
+    #   i = acc = 0
+    #   while True: acc += i; i += (0, 1)[1]; if not i < n: break
+    #   return acc
+    w = grm.write
+    cur, io, n = w(lam.Arg(0)), w(lam.Arg(1)), w(lam.Arg(2))
+    i = w(lam.Unpack(idx=1, tup=cur))
+    acc = w(lam.Unpack(idx=2, tup=cur))
+
+    def binop(op, lhs, rhs):
+        return w(
+            lam.Unpack(
+                idx=1, tup=w(Py_BinOp(opname=op, iostate=io, lhs=lhs, rhs=rhs))
+            )
+        )
+
+    # loop invariant
+    step = w(lam.Unpack(idx=1, tup=w(Py_Tuple((w(Py_Int(0)), w(Py_Int(1)))))))
+    i1 = binop("+", i, step)
+    acc1 = binop("+", acc, i)
+    cmp = w(Py_Compare(opname="<", iostate=io, lhs=i1, rhs=n))
+    cond = w(lam.Unpack(idx=1, tup=cmp))
+    loop = w(
+        Scfg_While(
+            test=w(Py_Int(1)),
+            body=w(lam.Lam(w(lam.Pack((cond, i1, acc1))))),
+        )
+    )
+    ret = w(Return(iostate=io, retval=w(lam.Unpack(idx=2, tup=loop))))
+    init = w(lam.Pack((w(Py_Int(1)), w(Py_Int(0)), w(Py_Int(0)))))
+    body = w(lam.App(arg=init, lam=w(lam.Lam(ret))))
+    lam_node = w(lam.Lam(w(lam.Lam(body))))
+    return lam_node, loop, step, i1
+
+
+def build_let_loop(grm):
+    # Same as `build_counting_loop` but the loop body is a let-chain, as
+    # the frontend makes:
+    #   i = acc = 0
+    #   while True: j = i + 1; k = acc + i; i, acc = j, k; if not j < n: break
+    #   return acc
+    w = grm.write
+
+    def binop(op, io, lhs, rhs):
+        return w(
+            lam.Unpack(
+                idx=1, tup=w(Py_BinOp(opname=op, iostate=io, lhs=lhs, rhs=rhs))
+            )
+        )
+
+    # j = i + 1; bound to Arg(0) in the first let
+    cur, io = w(lam.Arg(0)), w(lam.Arg(1))
+    j = binop("+", io, w(lam.Unpack(idx=1, tup=cur)), w(Py_Int(1)))
+    # k = acc + i; bound to Arg(0) in the second let
+    cur, io = w(lam.Arg(1)), w(lam.Arg(2))
+    i, acc = w(lam.Unpack(idx=1, tup=cur)), w(lam.Unpack(idx=2, tup=cur))
+    k = binop("+", io, acc, i)
+    # loop exit values
+    k_val, j_val = w(lam.Arg(0)), w(lam.Arg(1))
+    io, n = w(lam.Arg(3)), w(lam.Arg(4))
+    cmp = w(Py_Compare(opname="<", iostate=io, lhs=j_val, rhs=n))
+    cond = w(lam.Unpack(idx=1, tup=cmp))
+    inner = w(lam.Lam(w(lam.Pack((cond, j_val, k_val)))))
+    outer = w(lam.Lam(w(lam.App(arg=k, lam=inner))))
+    loop = w(
+        Scfg_While(
+            test=w(Py_Int(1)),
+            body=w(lam.Lam(w(lam.App(arg=j, lam=outer)))),
+        )
+    )
+    io = w(lam.Arg(1))
+    ret = w(Return(iostate=io, retval=w(lam.Unpack(idx=2, tup=loop))))
+    init = w(lam.Pack((w(Py_Int(1)), w(Py_Int(0)), w(Py_Int(0)))))
+    body = w(lam.App(arg=init, lam=w(lam.Lam(ret))))
+    lam_node = w(lam.Lam(w(lam.Lam(body))))
+    return lam_node, loop
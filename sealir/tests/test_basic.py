@@ -1,5 +1,8 @@
+from array import array
 from collections.abc import Generator
 
+import pytest
+
 from sealir import ase
 
 
@@ -8,8 +11,9 @@ def test_bottom():
     assert tape._read_token(0) is None
 
 
-def test_basic():
-    with ase.Tape() as tp:
+@pytest.mark.parametrize("storage", ["list", "array"])
+def test_basic(storage):
+    with ase.Tape(storage=storage) as tp:
         a = tp.expr("num", 1)
         b = tp.expr("num", 2)
         c = tp.expr("add", a, b)
@@ -32,8 +36,9 @@ def test_basic():
         assert ase.contains(p, a)
 
 
-def test_copy_tree():
-    with ase.Tape() as tp:
+@pytest.mark.parametrize("storage", ["list", "array"])
+def test_copy_tree(storage):
+    with ase.Tape(storage=storage) as tp:
         tp.expr("num", 0)
         a = tp.expr("num", 1)
         b = tp.expr("num", 2)
@@ -42,7 +47,7 @@ def test_copy_tree():
         d = tp.expr("sub", a, a)
         e = tp.expr("mul", b, d)
 
-    new_tree = ase.Tape()
+    new_tree = ase.Tape(storage=storage)
     new_e = ase.copy_tree_into(e, new_tree)
 
     assert len(new_tree._heap) < len(tp._heap)
@@ -52,6 +57,230 @@ def test_copy_tree():
     assert ase.pretty_str(new_e) == ase.pretty_str(e)
 
 
+def test_array_storage():
+    def build(tp):
+        with tp:
+            a = tp.expr("num", 1)
+            b = tp.expr("num", 2.5)
+            c = tp.expr("add", a, b, "hello", None)
+        return c
+
+    list_tape = ase.Tape()
+    array_tape = ase.Tape(storage="array")
+    lhs = build(list_tape)
+    rhs = build(array_tape)
+
+    assert list_tape.storage == "list"
+    assert array_tape.storage == "array"
+    assert isinstance(array_tape._heap, array)
+    assert list(list_tape._heap) == list(array_tape._heap)
+    assert list_tape.dump_raw() == array_tape.dump_raw()
+    assert ase.pretty_str(lhs) == ase.pretty_str(rhs)
+    assert array_tape.last() == rhs._handle
+    assert array_tape.load(rhs._handle, rhs._handle + 2) == (
+        ase.HandleSentry.BEGIN,
+        array_tape._tokenmap[str, "add"],
+    )
+
+    with pytest.raises(ValueError, match="invalid storage mode"):
+        ase.Tape(storage="unknown")
+
+
+def test_record_bounds():
+    with ase.Tape() as tp:
+        a = tp.expr("num", 1)
+        b = tp.expr("add", a, a)
+
+    assert tp.record_end(a._handle) == b._handle - 1
+    assert tp.record_end(b._handle) == tp.heap_size - 1
+    assert tp.record_bounds(b._handle + 2) == (b._handle, tp.heap_size - 1)
+    assert tp.last() == b._handle
+    with pytest.raises(ase.NotFound):
+        tp.record_end(a._handle + 1)
+    with pytest.raises(ase.NotFound):
+        tp.record_bounds(0)
+
+
+def test_parent_index():
+    with ase.Tape() as tp:
+        a = tp.expr("num", 1)
+        b = tp.expr("add", a, a)
+
+    assert tp._parent_index is None
+    assert list(ase.walk_parents(a)) == [b]
+    assert tp._parent_index is not None
+
+    # index is kept up to date by later writes
+    with tp:
+        c = tp.expr("neg", a)
+        d = tp.expr("sub", c, b)
+    assert list(ase.walk_parents(a)) == [b, c]
+    assert list(ase.walk_parents(b)) == [d]
+    assert list(ase.walk_parents(d)) == []
+    assert list(ase.search_ancestors(a, lambda x: x._head == "sub")) == [d]
+
+
+def test_interning():
+    with ase.Tape(intern=True) as tp:
+        a = tp.expr("num", 1)
+        b = tp.expr("num", 1)
+        c = tp.expr("num", 1.0)
+        d = tp.expr("add", a, b)
+        e = tp.expr("add", b, a)
+        f = tp.expr("add", a, c)
+
+    assert tp.interning
+    assert a == b
+    assert a != c
+    assert d == e
+    assert d != f
+    assert len(tp) == 4
+
+    # copying into an interning tape deduplicates as well
+    with ase.Tape() as plain:
+        x = plain.expr("num", 1)
+        y = plain.expr("num", 1)
+        z = plain.expr("add", x, y)
+    assert len(plain) == 3
+    interned = ase.Tape(intern=True)
+    new_z = ase.copy_tree_into(z, interned)
+    assert len(interned) == 2
+    assert ase.pretty_str(new_z) == "(add (num 1) (num 1))"
+
+
+@pytest.mark.parametrize("storage", ["list", "array"])
+def test_compact(storage):
+    with ase.Tape(storage=storage) as tp:
+        a = tp.expr("num", 1)
+        dead = tp.expr("num", 2)
+        b = tp.expr("num", 3)
+        tp.expr(".md.note", dead)
+        md_b = tp.expr(".md.note", b, "keep")
+        md_plain = tp.expr(".md.note", "no refs")
+        c = tp.expr("add", a, b)
+        tp.expr("sub", dead, c)
+
+    new_tape, remap = tp.compact([c._handle])
+    assert new_tape.storage == storage
+    assert set(remap) == {
+        a._handle,
+        b._handle,
+        md_b._handle,
+        md_plain._handle,
+        c._handle,
+    }
+    assert len(new_tape) == 5
+    new_c = ase.BasicSExpr(new_tape, remap[c._handle])
+    assert ase.pretty_str(new_c) == "(add (num 1) (num 3))"
+    new_md = ase.BasicSExpr(new_tape, remap[md_b._handle])
+    assert new_md._args == (ase.BasicSExpr(new_tape, remap[b._handle]), "keep")
+    new_plain = ase.BasicSExpr(new_tape, remap[md_plain._handle])
+    assert new_plain._args == ("no refs",)
+
+    new_tape, remap = tp.compact([c._handle], keep_metadata=False)
+    assert set(remap) == {a._handle, b._handle, c._handle}
+    assert new_tape.last() == remap[c._handle]
+
+
+def test_compact_keeps_rewrite_provenance():
+    from sealir.rewriter import TreeRewriter, metadata_find_original
+
+    class Fold(TreeRewriter[ase.SExpr]):
+        def rewrite_add(self, orig, lhs, rhs):
+            [x] = lhs._args
+            [y] = rhs._args
+            return orig._tape.expr("num", x + y)
+
+        def rewrite_mul(self, orig, lhs, rhs):
+            [x] = lhs._args
+            [y] = rhs._args
+            return orig._tape.expr("num", x * y)
+
+    with ase.Tape() as tp:
+        tp.expr("num", 0)  # dead
+        two = tp.expr("num", 2)
+        e = tp.expr("mul", tp.expr("add", tp.expr("num", 1), two), two)
+
+    fold = Fold()
+    with tp:
+        ase.apply_bottomup(e, fold)
+    folded = fold.memo[e]
+    assert ase.pretty_str(folded) == "(num 6)"
+
+    new_tape, remap = tp.compact([folded._handle])
+    assert e._handle in remap
+    new_folded = ase.BasicSExpr(new_tape, remap[folded._handle])
+    orig = metadata_find_original(new_folded, lambda x: x._head == "mul")
+    assert orig is not None
+    assert ase.pretty_str(orig) == ase.pretty_str(e)
+    # provenance of the intermediate rewrite is kept as well
+    sums = [
+        x
+        for x in new_tape.iter_expr()
+        if x._head == ".md.rewrite" and x._args[2]._head == "add"
+    ]
+    assert len(sums) == 1
+    # the dead record is still dropped
+    assert len(new_tape) == len(tp) - 1
+
+    new_tape, remap = tp.compact([folded._handle], keep_metadata=False)
+    assert set(remap) == {folded._handle}
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_save_and_load(tmp_path, use_mmap):
+    with ase.Tape() as tp:
+        a = tp.expr("num", 1)
+        b = tp.expr("num", 2.5)
+        c = tp.expr("add", a, b, "text", None, -1)
+        d = tp.expr("sub", c, a)
+
+    path = tmp_path / "example.tape"
+    tp.save(path)
+    loaded = ase.Tape.from_file(path, use_mmap=use_mmap)
+
+    assert loaded.storage == ("mmap" if use_mmap else "array")
+    assert len(loaded) == len(tp)
+    assert loaded.heap_size == tp.heap_size
+    assert loaded.dump() == tp.dump().replace(hex(id(tp)), hex(id(loaded)))
+    assert loaded.last() == d._handle
+
+    new_a = loaded.read_value(a._handle)
+    new_d = loaded.read_value(d._handle)
+    assert ase.pretty_str(new_d) == ase.pretty_str(d)
+    assert [p._handle for p in ase.walk_parents(new_a)] == [
+        c._handle,
+        d._handle,
+    ]
+    assert loaded.index(c._handle, c._handle + 1) == d._handle + 2
+
+    if use_mmap:
+        with pytest.raises(ase.ReadOnlyHeap):
+            loaded.expr("num", 3)
+    else:
+        e = loaded.expr("mul", new_d, new_d)
+        assert ase.pretty_str(e).startswith("(mul")
+
+
+def test_load_invalid_file(tmp_path):
+    path = tmp_path / "invalid.tape"
+    path.write_bytes(b"not a tape")
+    with pytest.raises(ValueError, match="not a sealir tape file"):
+        ase.Tape.from_file(path)
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_load_truncated_file(tmp_path, use_mmap):
+    with ase.Tape() as tp:
+        tp.expr("add", tp.expr("num", 1), tp.expr("num", 2))
+
+    path = tmp_path / "truncated.tape"
+    tp.save(path)
+    path.write_bytes(path.read_bytes()[:-40])
+    with pytest.raises(ValueError, match="truncated tape file"):
+        ase.Tape.from_file(path, use_mmap=use_mmap)
+
+
 def test_apply_bottomup():
     with ase.Tape() as tp:
         a = tp.expr("num", 1)
@@ -81,6 +310,138 @@ def test_apply_bottomup():
     assert buffer == [a, b, c, e]
 
 
+def test_reachable_set():
+    with ase.Tape() as tp:
+        a = tp.expr("num", 1)
+        b = tp.expr("num", 2)
+        c = tp.expr("sub", a, a)
+        md = tp.expr(".md.note", c)
+        d = tp.expr("add", c, b)
+        e = tp.expr("mul", md, c)
+
+    reachable = ase.reachable_set(e)
+    assert len(reachable) == 4
+    assert list(reachable) == [a, c, md, e]
+    assert list(reachable.handles()) == [x._handle for x in (a, c, md, e)]
+    assert a in reachable
+    assert b not in reachable
+    assert d not in reachable
+    assert "num" not in reachable
+    assert reachable == {a, c, md, e}
+
+    # metadata is never visited
+    buffer = []
+
+    class BufferVisitor(ase.TreeVisitor):
+        def visit(self, expr: ase.SExpr):
+            buffer.append(expr)
+
+    ase.apply_bottomup(e, BufferVisitor(), reachable=reachable)
+    assert buffer == [a, c, e]
+
+
+def test_walk_descendants_variants():
+    with ase.Tape() as tp:
+        a = tp.expr("num", 1)
+        b = tp.expr("num", 2)
+        c = tp.expr("sub", a, b)
+        d = tp.expr("add", c, a)
+
+    expected = list(ase.walk_descendants(d))
+    assert [x for _, x in expected] == [d, c, a, a, b]
+    assert list(ase.iter_descendants(d)) == [x for _, x in expected]
+    assert list(ase.walk_descendants_with_depth(d)) == [
+        (len(ps), x) for ps, x in expected
+    ]
+    assert list(ase.walk_descendants_with_parent(d)) == [
+        (ps[-1] if ps else None, x) for ps, x in expected
+    ]
+    chains = ase.walk_descendants_fold(d, lambda ps, p: (*ps, p), ())
+    assert list(chains) == expected
+
+    crawler = ase.TapeCrawler(tp, lambda x: x)
+    crawler.seek(d._handle)
+    assert [r.handle for r in crawler.iter_descendants()] == [
+        x._handle for _, x in expected
+    ]
+
+
+def test_handle_memo():
+    with ase.Tape() as tp:
+        a = tp.expr("num", 1)
+        b = tp.expr("num", 2)
+        c = tp.expr("add", a, b)
+
+    memo = ase.HandleMemo()
+    assert a not in memo
+    # non-expression keys on an unbound memo
+    assert 5 not in memo
+    assert memo.get("x") is None
+    with pytest.raises(KeyError):
+        memo[None]
+    memo[c] = "c"
+    memo[a] = "a"
+    assert len(memo) == 2
+    assert memo[ase.BasicSExpr(tp, a._handle)] == "a"
+    assert memo.lookup_handle(c._handle) == "c"
+    assert b not in memo
+    with pytest.raises(KeyError):
+        memo[b]
+    with pytest.raises(KeyError):
+        memo.lookup_handle(b._handle)
+    # keys come back in tape order
+    assert list(memo.items()) == [(a, "a"), (c, "c")]
+    del memo[a]
+    assert list(memo) == [c]
+
+    other = ase.Tape()
+    x = other.expr("num", 1)
+    assert x not in memo
+    with pytest.raises(ValueError):
+        memo[x] = "x"
+    assert 5 not in memo
+    assert memo.get("x", "default") == "default"
+
+
+def test_find_by_head():
+    with ase.Tape() as tp:
+        a = tp.expr("num", 1)
+        b = tp.expr("num", 2)
+        c = tp.expr("add", a, b)
+        d = tp.expr("num", 3)
+
+    assert tp.find_by_head("num") == array(
+        "q", [a._handle, b._handle, d._handle]
+    )
+    assert tp.find_by_head("unknown") == array("q")
+    # the index is kept up to date on write
+    with tp:
+        e = tp.expr("add", c, d)
+    assert list(tp.find_by_head("add")) == [c._handle, e._handle]
+    assert list(tp.find_by_head(["add", "num"], start=b._handle)) == [
+        b._handle,
+        c._handle,
+        d._handle,
+        e._handle,
+    ]
+    assert list(tp.find_by_head("num", stop=d._handle)) == [
+        a._handle,
+        b._handle,
+    ]
+    reachable = ase.reachable_set(c)
+    assert list(tp.find_by_head("num", within=reachable)) == [
+        a._handle,
+        b._handle,
+    ]
+    # the tape grows past the set
+    with tp:
+        tp.expr("num", 4)
+    assert list(tp.find_by_head("num", within=reachable)) == [
+        a._handle,
+        b._handle,
+    ]
+
+
 def test_calculator():
     with ase.Tape() as tp:
         a = tp.expr("num", 123)
@@ -122,7 +483,8 @@ def test_calculator():
     assert expected() == result
 
 
-def test_calculator_traverse():
+@pytest.mark.parametrize("memo_by_handle", [False, True])
+def test_calculator_traverse(memo_by_handle):
     with ase.Tape() as tp:
         a = tp.expr("num", 123)
         b = tp.expr("num", 321)
@@ -151,7 +513,8 @@ def test_calculator_traverse():
             case _:
                 raise AssertionError(sexpr)
 
-    memo = ase.traverse(e, calc)
+    memo = ase.traverse(e, calc, memo_by_handle=memo_by_handle)
+    assert isinstance(memo, ase.HandleMemo) == memo_by_handle
     result = memo[e]
 
     def expected():
@@ -163,3 +526,17 @@ def test_calculator_traverse():
         return e
 
     assert expected() == result
+
+    # continue from an existing memo; known nodes are not visited again
+    visited = []
+
+    def calc_logged(sexpr, state):
+        visited.append(sexpr)
+        return (yield from calc(sexpr, state))
+
+    with tp:
+        f = tp.expr("add", e, tp.expr("num", 1))
+    out = ase.traverse(f, calc_logged, memo=memo)
+    assert out is memo
+    assert memo[f] == result + 1
+    assert visited == [f, f._args[1]]
@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from sealir.cache_utils import atomic_write, package_versions
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "entry.bin"
+    path.write_bytes(b"old")
+    with atomic_write(path) as tmppath:
+        with open(tmppath, "wb") as fout:
+            fout.write(b"new")
+        # not visible until the block exits
+        assert path.read_bytes() == b"old"
+    assert path.read_bytes() == b"new"
+    assert os.listdir(tmp_path) == ["entry.bin"]
+
+    with pytest.raises(RuntimeError):
+        with atomic_write(path) as tmppath:
+            with open(tmppath, "wb") as fout:
+                fout.write(b"partial")
+            raise RuntimeError("failed")
+    assert path.read_bytes() == b"new"
+    assert os.listdir(tmp_path) == ["entry.bin"]
+
+
+def test_package_versions():
+    sealir_version, other = package_versions("no-such-distribution")
+    assert sealir_version
+    assert other == "unknown"
+    assert package_versions()[0] == sealir_version
@@ -1,3 +1,5 @@
+import gc
+import weakref
 from collections.abc import Generator
 
 from sealir import ase, grammar
@@ -118,6 +120,13 @@ def test_calculator_traverse():
     memo = ase.traverse(e, calc)
     result = memo[e]
 
+    # a handle memo gives back the same grammar nodes
+    by_handle = ase.traverse(e, calc, memo_by_handle=True)
+    assert isinstance(by_handle, ase.HandleMemo)
+    assert list(by_handle) == sorted(memo, key=lambda x: x._handle)
+    assert [type(x) for x in by_handle] == [type(x) for x in [a, b, c, d, e]]
+    assert dict(by_handle.items()) == dict(memo.items())
+
     def expected():
         a = 123
         b = 321
@@ -189,3 +198,143 @@ def test_three_grammar():
         a1 = grm.write(Another(value=g1))
 
     assert ThreeGrammar.start._combined == (_VarargVal, Val, Another)
+
+
+def test_named_sexpr_class_is_shared():
+    with ase.Tape() as tp:
+        grm = CalcGrammar(tp)
+        a = grm.write(Num(value=1))
+        b = grm.write(Num(value=2))
+        c = grm.write(Add(lhs=a, rhs=b))
+
+    assert type(a) is type(b)
+    assert type(a) is not type(c)
+    assert type(CalcGrammar.downcast(ase.BasicSExpr(tp, a._handle))) is type(a)
+    assert type(c).__match_args__ == ("lhs", "rhs")
+    assert not hasattr(c, "value")
+
+
+def test_named_sexpr_class_released_with_grammar():
+    def make():
+        class LocalGrammar(grammar.Grammar):
+            start = Val
+
+        with LocalGrammar(ase.Tape()) as grm:
+            a = grm.write(Num(value=1))
+            LocalGrammar.downcast(ase.BasicSExpr(grm._tape, a._handle))
+        assert type(a) is LocalGrammar._named_subclasses[Num]
+        return weakref.ref(LocalGrammar), weakref.ref(type(a))
+
+    grammar_ref, subclass_ref = make()
+    gc.collect()
+    assert grammar_ref() is None
+    assert subclass_ref() is None
+
+
+def test_downcast_cache():
+    with ase.Tape() as tp:
+        grm = CalcGrammar(tp)
+        a = grm.write(Num(value=1))
+        b = grm.write(Num(value=2))
+
+    before = CalcGrammar.downcast_cache_info(tp)
+    x = CalcGrammar.downcast(ase.BasicSExpr(tp, a._handle))
+    y = CalcGrammar.downcast(ase.BasicSExpr(tp, a._handle))
+    assert x is y
+    info = CalcGrammar.downcast_cache_info(tp)
+    assert info.hits == before.hits + 1
+    assert info.misses == before.misses + 1
+
+    # the cache is per tape
+    other = ase.Tape()
+    assert CalcGrammar.downcast_cache_info(other).currsize == 0
+
+    # and per grammar; it only holds the expressions still in use
+    class OtherGrammar(grammar.Grammar):
+        start = Val
+
+    u = OtherGrammar.downcast(a)
+    assert OtherGrammar.downcast(a) is u
+    v = OtherGrammar.downcast(b)
+    assert OtherGrammar.downcast_cache_info(tp) == grammar.DowncastCacheInfo(
+        hits=1, misses=2, maxsize=None, currsize=2
+    )
+    del v
+    assert OtherGrammar.downcast_cache_info(tp).currsize == 1
+    assert OtherGrammar.downcast(a) is u
+
+
+def test_downcast_cache_size():
+    class BoundedGrammar(grammar.Grammar):
+        start = Val
+        downcast_cache_size = 2
+
+    class UncachedGrammar(grammar.Grammar):
+        start = Val
+        downcast_cache_size = 0
+
+    with ase.Tape() as tp:
+        nums = [
+            ase.BasicSExpr(tp, tp.expr("Num", i)._handle) for i in range(3)
+        ]
+
+    a = BoundedGrammar.downcast(nums[0])
+    b = BoundedGrammar.downcast(nums[1])
+    assert BoundedGrammar.downcast(nums[0]) is a
+    # `b` is the least recently used and is evicted although still alive
+    c = BoundedGrammar.downcast(nums[2])
+    assert BoundedGrammar.downcast_cache_info(tp) == grammar.DowncastCacheInfo(
+        hits=1, misses=3, maxsize=2, currsize=2
+    )
+    assert BoundedGrammar.downcast(nums[1]) is not b
+    assert BoundedGrammar.downcast(nums[2]) is c
+    assert BoundedGrammar.downcast(nums[0]) is not a
+
+    x = UncachedGrammar.downcast(nums[0])
+    assert UncachedGrammar.downcast(nums[0]) is not x
+    info = UncachedGrammar.downcast_cache_info(tp)
+    assert (info.hits, info.currsize) == (0, 0)
+
+
+def test_downcast_cache_released_with_tape():
+    tp = ase.Tape()
+    grm = CalcGrammar(tp)
+    a = grm.write(Num(value=1))
+    CalcGrammar.downcast(ase.BasicSExpr(tp, a._handle))
+    ref = weakref.ref(tp)
+    # no reference cycle through the cache
+    gc.disable()
+    try:
+        del tp, grm, a
+        assert ref() is None
+    finally:
+        gc.enable()
+
+
+def test_rewrite_handler_binding():
+    class VarargGrammar(grammar.Grammar):
+        start = _VarargVal | Val
+
+    with VarargGrammar(ase.Tape()) as grm:
+        n1 = grm.write(Num(123))
+        g1 = grm.write(Grouped(head="heading", vargs=(n1, 1321)))
+        g2 = grm.write(Grouped(head="heading2", vargs=(g1,)))
+
+    seen = []
+
+    class Positional(grammar.TreeRewriter[ase.SExpr]):
+        def rewrite_Grouped(self, orig, head, vargs):
+            seen.append((head, vargs))
+            return self.passthru()
+
+    class ByKeyword(grammar.TreeRewriter[ase.SExpr]):
+        def rewrite_Grouped(self, orig, *, vargs, **kwargs):
+            seen.append((kwargs["head"], vargs))
+            return self.passthru()
+
+    for cls in [Positional, ByKeyword]:
+        seen.clear()
+        ase.apply_bottomup(g2, cls())
+        assert seen == [("heading", (n1, 1321)), ("heading2", (g1,))]
+
+    assert g2._bind("heading2", g1) == {"head": "heading2", "vargs": (g1,)}
@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+from sealir import ase
+from sealir.numpy_batch import compile_batch
+from sealir.rvsdg import Grammar, restructure_source
+from sealir.tests.lam_builders import build_counting_loop, build_let_loop
+
+
+def test_straight_line():
+    def udt(n: int, m: int) -> int:
+        a = n + m * 10
+        b = a - n // 2
+        return b / m
+
+    run(udt, np.arange(10), np.arange(1, 11))
+
+
+def test_broadcast_scalar():
+    def udt(n: int, m: int) -> int:
+        a = n * m
+        return a
+
+    run(udt, np.arange(10), 3)
+
+
+def test_uniform_result():
+    def udt(n: int, m: int) -> int:
+        return m
+
+    run(udt, np.arange(5), 7)
+
+
+def test_masked_if_else():
+    def udt(n: int, m: int) -> int:
+        if n < m:
+            a = n * 2
+        else:
+            a = m - 1
+        return a
+
+    run(udt, np.arange(10), 5)
+    # all rows take the same branch
+    run(udt, np.arange(10), 100)
+    run(udt, np.arange(10), -1)
+
+
+def test_nested_if_else():
+    def udt(n: int, m: int) -> int:
+        a = 0
+        if n > 3:
+            if m > 4:
+                a = n + m
+            else:
+                a = 1
+        return a
+
+    run(udt, np.arange(10), np.arange(10)[::-1])
+
+
+def test_mixed_types():
+    def udt(n: int, m: int) -> int:
+        if n > m:
+            a = "big"
+        else:
+            a = (n, m)
+        return a
+
+    out = run(udt, np.arange(6), 2)
+    assert out.dtype == object
+
+
+def test_bool_arithmetic():
+    def udt(n: int, m: int) -> int:
+        a = n + m
+        b = n - m
+        c = n * m
+        return a * 100 + b * 10 + c
+
+    flags = np.array([True, True, False, False])
+    out = run(udt, flags, np.array([True, False, True, False]))
+    assert out.tolist() == [201, 110, 90, 0]
+    run(udt, flags, True)
+
+
+@pytest.mark.parametrize("build", [build_counting_loop, build_let_loop])
+def test_loop_rowwise(build):
+    grm = Grammar(ase.Tape())
+    lam_node, *_ = build(grm)
+    fn = compile_batch(lam_node)
+    n = np.array([1, 2, 10, 0])
+    got = fn(n)
+    assert got.tolist() == [sum(range(x)) for x in n.tolist()]
+
+
+def test_bad_arguments():
+    def udt(n: int, m: int) -> int:
+        return n + m
+
+    fn = compile_batch(restructure_source(udt))
+    with pytest.raises(ValueError, match="at least one"):
+        fn(1, 2)
+    with pytest.raises(ValueError, match="different lengths"):
+        fn(np.arange(3), np.arange(4))
+    with pytest.raises(ValueError, match="1-D"):
+        fn(np.zeros((2, 2)), 1)
+
+
+def run(func, *args):
+    size = max(np.size(arg) for arg in args)
+    expected = [
+        func(*(arg[i].item() if np.ndim(arg) else arg for arg in args))
+        for i in range(size)
+    ]
+
+    got = compile_batch(restructure_source(func))(*args)
+    assert isinstance(got, np.ndarray)
+    assert got.shape == (size,)
+    assert got.tolist() == expected
+    return got
@@ -0,0 +1,121 @@
+from sealir import ase, grammar
+from sealir.patterns import PatternRewriter, PatternRule, Var
+
+
+class Val(grammar.Rule):
+    pass
+
+
+class Num(Val):
+    value: int
+
+
+class Add(Val):
+    lhs: ase.SExpr
+    rhs: ase.SExpr
+
+
+class Mul(Val):
+    lhs: ase.SExpr
+    rhs: ase.SExpr
+
+
+class Tuple(Val):
+    elts: tuple[ase.SExpr, ...]
+
+
+class CalcGrammar(grammar.Grammar):
+    start = Val
+
+
+x = Var("x")
+y = Var("y")
+
+rules = [
+    PatternRule("add-zero", Add(lhs=Num(0), rhs=x), x),
+    PatternRule("mul-one", Mul(lhs=Num(1), rhs=x), x),
+    PatternRule("mul-zero", Mul(lhs=Num(0), rhs=x), Num(0)),
+    PatternRule("double", Add(lhs=x, rhs=x), Mul(lhs=Num(2), rhs=x)),
+    PatternRule(
+        "fold-add",
+        Add(lhs=Num(x), rhs=Num(y)),
+        lambda x, y: Num(x + y),
+    ),
+    PatternRule(
+        "fold-mul",
+        Mul(lhs=Num(x), rhs=Num(y)),
+        lambda x, y: Num(x * y),
+        guard=lambda x, y: x != 0 and x != 1,
+    ),
+    PatternRule("tuple-unit", Tuple(elts=(x,)), x),
+    PatternRule("tuple-head-zero", Tuple(elts=Var("rest")), Num(-1)),
+]
+
+
+def test_fixpoint():
+    with CalcGrammar(ase.Tape()) as grm:
+        a = grm.write(Num(3))
+        zero = grm.write(Num(0))
+        one = grm.write(Num(1))
+        b = grm.write(Add(lhs=zero, rhs=a))
+        c = grm.write(Mul(lhs=one, rhs=b))
+        d = grm.write(Add(lhs=c, rhs=c))
+        root = grm.write(Tuple((d,)))
+
+    out, report = PatternRewriter(rules).apply(grm, root)
+    assert ase.pretty_str(out) == "(Num 6)"
+    assert report.converged
+    assert len(report.pass_times) == 3
+    assert report.fired == {
+        "add-zero": 1,
+        "mul-one": 1,
+        "double": 1,
+        "fold-mul": 1,
+        "tuple-unit": 1,
+    }
+    assert report.unused() == ["mul-zero", "fold-add", "tuple-head-zero"]
+
+
+def test_vararg_and_nonlinear():
+    with CalcGrammar(ase.Tape()) as grm:
+        a = grm.write(Num(3))
+        b = grm.write(Num(4))
+        c = grm.write(Add(lhs=a, rhs=b))
+        root = grm.write(Tuple((c, a)))
+
+    out, report = PatternRewriter(rules).apply(grm, root, max_passes=1)
+    # `double` does not match `Add(a, b)`; `fold-add` does
+    assert report.fired == {"fold-add": 1, "tuple-head-zero": 1}
+    assert ase.pretty_str(out) == "(Num -1)"
+    assert not report.converged
+
+
+def test_rule_order():
+    with CalcGrammar(ase.Tape()) as grm:
+        a = grm.write(Num(3))
+        root = grm.write(Tuple((a,)))
+
+    # a vararg rule declared first takes priority over an exact one
+    ordered = [
+        PatternRule("tuple-any", Tuple(elts=Var("rest")), Num(-1)),
+        PatternRule("tuple-unit", Tuple(elts=(x,)), x),
+    ]
+    out, report = PatternRewriter(ordered).apply(grm, root, max_passes=1)
+    assert report.fired == {"tuple-any": 1}
+    out, report = PatternRewriter(ordered[::-1]).apply(grm, root)
+    assert report.fired == {"tuple-unit": 1}
+    assert out == a
+
+
+def test_history():
+    def run(save_history):
+        with CalcGrammar(ase.Tape()) as grm:
+            zero = grm.write(Num(0))
+            root = grm.write(Add(lhs=zero, rhs=grm.write(Num(3))))
+        PatternRewriter(rules).apply(grm, root, save_history=save_history)
+        return [
+            rec for rec in grm._tape.iter_expr() if rec._head == ".md.rewrite"
+        ]
+
+    assert run(False) == []
+    assert len(run(True)) == 1
@@ -1,10 +1,15 @@
+import pytest
+
 from sealir import ase
-from sealir.rewriter import TreeRewriter
+from sealir.rewriter import RewriteSession, TreeRewriter
 
 
-def test_rewrite():
+@pytest.mark.parametrize("memo_by_handle", [False, True])
+def test_rewrite(memo_by_handle):
 
     class RewriteCalcMachine(TreeRewriter[ase.SExpr]):
+        flag_memo_by_handle = memo_by_handle
+
         def rewrite_add(self, orig, lhs, rhs):
             tp = orig._tape
             [x] = lhs._args
@@ -52,3 +57,91 @@ def test_rewrite():
     print(mintree.dump())
     assert ase.pretty_str(new_reduced) == ase.pretty_str(reduced)
     assert len(mintree) == 1
+
+
+def test_rewrite_handler_lookup():
+    class Eval(TreeRewriter[int]):
+        flag_save_history = False
+
+        @staticmethod
+        def rewrite_num(orig, value):
+            return value
+
+        @classmethod
+        def rewrite_neg(cls, orig, value):
+            assert cls is Eval
+            return -value
+
+        def rewrite_add(self, orig, lhs, rhs):
+            return lhs + rhs
+
+    with ase.Tape() as tp:
+        a = tp.expr("num", 1)
+        b = tp.expr("neg", a)
+        c = tp.expr("add", a, b)
+        d = tp.expr("sub", c, a)
+
+    ev = Eval()
+    ase.apply_bottomup(c, ev)
+    assert ev.memo[c] == 0
+
+    # handlers assigned to an instance or to the class after it is made
+    ev = Eval()
+    ev.rewrite_sub = lambda orig, lhs, rhs: lhs - rhs
+    Eval.rewrite_add = lambda self, orig, lhs, rhs: lhs * rhs
+    ase.apply_bottomup(d, ev)
+    assert ev.memo[d] == -2
+
+
+def test_rewrite_session():
+    class Count(TreeRewriter[int]):
+        flag_save_history = False
+
+        def rewrite_num(self, orig, value):
+            return value
+
+        def rewrite_add(self, orig, lhs, rhs):
+            return lhs + rhs
+
+        def rewrite_tag(self, orig, value, note):
+            assert ase.is_metadata(note)
+            return value
+
+    with ase.Tape() as tp:
+        a = tp.expr("num", 1)
+        b = tp.expr("num", 2)
+        c = tp.expr("add", a, b)
+
+    session = RewriteSession(Count())
+    assert session.run(c) == 3
+    assert session.last_visited == 3
+
+    # Only the appended records are visited
+    with tp:
+        d = tp.expr("num", 10)
+        e = tp.expr("add", c, d)
+    assert session.run(e) == 13
+    assert session.last_visited == 2
+
+    # A new root over old records reuses their results
+    with tp:
+        f = tp.expr("add", b, b)
+    assert session.run(f) == 4
+    assert session.last_visited == 1
+
+    assert session.run(e) == 13
+    assert session.last_visited == 0
+
+    # Metadata records are skipped, even when reachable
+    with tp:
+        md = tp.expr(".md.note", e)
+        g = tp.expr("tag", f, md)
+    assert session.run(g) == 4
+    assert session.last_visited == 1
+    with tp:
+        h = tp.expr("tag", g, md)
+    assert session.run(h) == 4
+    assert session.last_visited == 1
+
+    with pytest.raises(ValueError):
+        session.run(ase.Tape().expr("num", 1))
@@ -1,3 +1,4 @@
+import os
 from collections import ChainMap
 
 from sealir import ase, lam
@@ -5,9 +6,16 @@ from sealir.rvsdg import (
     EvalCtx,
     EvalLamState,
     Grammar,
+    RestructureCache,
+    Scfg_While,
+    _STEP_BIND,
+    _STEP_UNBIND,
+    _loop_schedule,
+    compile_lambda,
     lambda_evaluation,
     restructure_source,
 )
+from sealir.tests.lam_builders import build_counting_loop, build_let_loop
 
 
 def test_return_arg0():
@@ -275,10 +283,172 @@ def test_f_o_r_t_r_a_n():
     run(foo, args, localscope=ChainMap(locals(), globals()))
 
 
-def run(func, args, *, localscope=None):
+def test_restructure_cache(tmp_path):
+    def udt(n: int, m: int) -> int:
+        a = n + m * 10
+        if a > n:
+            a = a - 1
+        return a
+
+    args = (12, 32)
+    cache = RestructureCache(tmp_path)
+    missed = restructure_source(udt, cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    hit = restructure_source(udt, cache=cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    # a miss returns the same tree as a hit, in its own tape
+    assert missed._tape is not hit._tape
+    assert len(missed._tape) == len(hit._tape)
+    assert ase.pretty_str(missed) == ase.pretty_str(hit)
+    assert os.listdir(tmp_path) == [f"{cache.key(udt)}.tape"]
+    run(udt, args, cache=cache)
+
+    # a new cache finds it on disk
+    fresh = RestructureCache(tmp_path)
+    run(udt, args, cache=fresh)
+    assert (fresh.hits, fresh.misses) == (1, 0)
+    assert ase.pretty_str(fresh.get(udt)) == ase.pretty_str(
+        restructure_source(udt)
+    )
+
+    # a damaged entry is a miss and is replaced
+    path = tmp_path / f"{cache.key(udt)}.tape"
+    path.write_bytes(path.read_bytes()[:-40])
+    damaged = RestructureCache(tmp_path)
+    assert damaged.get(udt) is None
+    assert not path.exists()
+    run(udt, args, cache=damaged)
+    assert (damaged.hits, damaged.misses) == (0, 2)
+    assert RestructureCache(tmp_path).get(udt) is not None
+
+
+def test_pipeline_stats():
+    def udt(n: int, m: int) -> int:
+        a = n + m * 10
+        return a
+
+    collected = []
+    restructure_source(udt, stats_sink=collected.append, trace_memory=True)
+    [stats] = collected
+    assert stats.function == udt.__qualname__
+    assert [st.name for st in stats.stages] == [
+        "ast_to_scfg",
+        "restructure",
+        "convert_to_sexpr",
+        "find_variable_info",
+        "convert_to_rvsdg",
+        "convert_to_lambda",
+    ]
+    assert all(st.seconds >= 0 for st in stats.stages)
+    assert all(st.peak_memory is not None for st in stats.stages)
+    sexpr_stage = stats.stages[2]
+    assert sexpr_stage.heap_size_before == 0
+    assert sexpr_stage.heap_size_after > 0
+    for prev, cur in zip(stats.stages[2:], stats.stages[3:]):
+        assert cur.heap_size_before == prev.heap_size_after
+    assert stats.head_counts["Lam"] > 0
+    assert stats.total_seconds == sum(st.seconds for st in stats.stages)
+
+
+def evaluate(grm, lam_node, arg, corofunc=lambda_evaluation):
+    ctx = EvalCtx.from_arguments(arg)
+    with grm:
+        app_root = lam.app_func(grm, lam_node, *ctx.make_arg_node(grm))
+    memo = ase.traverse(app_root, corofunc, EvalLamState(context=ctx))
+    return memo[app_root][1]
+
+
+def unscheduled_evaluation(expr, state):
+    # Evaluates a loop body with a fresh traversal per iteration
+    match expr:
+        case Scfg_While(body=loopblk):
+            ctx = state.context
+            loop_cond = True
+            while loop_cond:
+                memo = ase.traverse(loopblk, unscheduled_evaluation, state)
+                loop_end_vars = memo[loopblk]
+                loop_cond = loop_end_vars[0]
+                ctx.blam_stack[-1] = ctx.blam_stack[-1]._replace(
+                    value=loop_end_vars
+                )
+            return loop_end_vars
+        case _:
+            return (yield from lambda_evaluation(expr, state))
+
+
+def test_compile_lambda_loop():
+    grm = Grammar(ase.Tape())
+    lam_node, *_ = build_counting_loop(grm)
+
+    compiled = compile_lambda(lam_node)
+    for arg in [1, 2, 10]:
+        expected = sum(range(arg))
+        assert evaluate(grm, lam_node, arg) == expected
+        assert compiled(arg) == expected
+
+
+def test_loop_schedule():
+    grm = Grammar(ase.Tape())
+    lam_node, loop, step, i1 = build_counting_loop(grm)
+
+    schedule = _loop_schedule(loop.body)
+    order = [handle for kind, handle in schedule.steps]
+    assert step._handle in schedule.invariant
+    assert i1._handle in order
+    assert not set(schedule.invariant) & set(order)
+    # children before parents
+    assert order[-1] == loop.body._handle
+    pos = {handle: k for k, handle in enumerate(order)}
+    for handle in order:
+        for child in grm._tape.read_args(handle):
+            if isinstance(child, ase.SExpr) and child._handle in pos:
+                assert pos[child._handle] < pos[handle]
+
+    for arg in [1, 2, 10]:
+        expected = evaluate(grm, lam_node, arg, unscheduled_evaluation)
+        assert expected == sum(range(arg))
+        assert evaluate(grm, lam_node, arg) == expected
+
+    # computed once per tape and loop body; only handles are kept
+    assert _loop_schedule(loop.body) is schedule
+    assert list(grm._tape._caches[_loop_schedule]) == [loop.body._handle]
+
+
+def test_loop_schedule_let_chain(monkeypatch):
+    grm = Grammar(ase.Tape())
+    lam_node, loop = build_let_loop(grm)
+
+    schedule = _loop_schedule(loop.body)
+    kinds = [kind for kind, _ in schedule.steps]
+    assert kinds.count(_STEP_BIND) == kinds.count(_STEP_UNBIND) == 2
+    # the let bodies are scheduled, not left to a traversal
+    scheduled = {handle for _, handle in schedule.steps}
+    for _, node in ase.walk_descendants_depth_first_no_repeat(loop.body):
+        assert node._handle in scheduled or node._handle in schedule.invariant
+
+    for arg in [1, 2, 10]:
+        expected = evaluate(grm, lam_node, arg, unscheduled_evaluation)
+        assert expected == sum(range(arg))
+        assert evaluate(grm, lam_node, arg) == expected
+    assert compile_lambda(lam_node)(10) == sum(range(10))
+
+    # the only traversal is the one started by `evaluate`
+    calls = []
+    traverse = ase.traverse
+
+    def counting_traverse(*args, **kwargs):
+        calls.append(args[0])
+        return traverse(*args, **kwargs)
+
+    monkeypatch.setattr(ase, "traverse", counting_traverse)
+    assert evaluate(grm, lam_node, 1000) == sum(range(1000))
+    assert len(calls) == 1
+
+
+def run(func, args, *, localscope=None, cache=None):
     expected = func(*args)
 
-    lam_node = restructure_source(func)
+    lam_node = restructure_source(func, cache=cache)
 
     # Prepare run
     grm = Grammar(lam_node._tape)
@@ -305,4 +475,7 @@ def run(func, args, *, localscope=None):
     got = res[1]
 
     assert got == expected
+
+    compiled = compile_lambda(lam_node, localscope=localscope)
+    assert compiled(*args) == expected
     return got
@@ -3,7 +3,7 @@ from collections import ChainMap
 import pytest
 
 from sealir import ase, lam
-from sealir.llvm_pyapi_backend import llvm_codegen
+from sealir.llvm_pyapi_backend import JitCache, llvm_codegen
 from sealir.rvsdg import Grammar, restructure_source
 
 
@@ -214,13 +214,168 @@ def test_for_if_1():
     run(udt, args)
 
 
-def run(func, args, *, localscope=None):
+def test_jit_cache(tmp_path, monkeypatch):
+    def udt(n: int) -> tuple[int, int]:
+        it = iter(range(n))
+        a = next(it)
+        b = next(it)
+        return a, b
+
+    def udt2(n: int, m: int) -> int:
+        a = n + m
+        return a
+
+    keys = []
+    key = JitCache.key
+    monkeypatch.setattr(
+        JitCache, "key", lambda *args: keys.append(key(*args)) or keys[-1]
+    )
+
+    cache = JitCache(tmp_path)
+    run(udt, (5,), cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    # the key is computed once for the lookup and the store
+    assert len(keys) == 1
+    [entry] = tmp_path.iterdir()
+    assert entry.name == f"{keys[0]}.o"
+
+    # Another cache on the same directory, e.g. in a new process
+    cache = JitCache(tmp_path)
+    run(udt, (7,), cache=cache)
+    assert (cache.hits, cache.misses) == (1, 0)
+
+    # Adding an entry evicts the least recently used one
+    cache = JitCache(tmp_path, max_bytes=entry.stat().st_size)
+    run(udt2, (1, 2), cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert not entry.exists()
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+@pytest.mark.parametrize("opt", [0, 1, 2, 3])
+def test_opt_levels(opt, tmp_path):
+    def udt(n: int, m: int) -> int:
+        a = n + m * 3
+        if a > 10:
+            a = a - 1
+        return a
+
+    dump = tmp_path / "dump.ll"
+    run(udt, (3, 4), opt=opt, dump_ir=dump)
+    before, after = dump.read_text().split(f"; after optimization (O{opt})")
+    assert "alloca" in before
+    if opt > 0:
+        # mem2reg removed the return value slot
+        assert "alloca" not in after
+
+    with pytest.raises(ValueError):
+        llvm_codegen(restructure_source(udt), opt=4)
+
+
+def test_typed_if_else():
+    def udt(n: int, m: float) -> float:
+        if n < m:
+            a = n * 2
+        else:
+            a = m / 2
+        return a
+
+    # `a` is an int or a float depending on the branch
+    for args in [(1, 5.0), (7, 3.0), (7, 3)]:
+        res = run(udt, args, argtypes=(int, float))
+        assert type(res) is type(udt(*args))
+
+
+def test_typed_arith():
+    def udt(n: int, m: int) -> tuple[int, bool, bool]:
+        a = n // m
+        b = n > m
+        c = not b
+        return a, b, c
+
+    for args in [(7, 2), (-7, 2), (7, -2), (-7, -2), (6, 3)]:
+        run(udt, args, argtypes=(int, int))
+    for args in [
+        (7.5, 2.0),
+        (-7.5, 2.0),
+        (1.0, 0.1),
+        (-1.0, 0.1),
+        (1.0, -0.1),
+        (-0.0, 3.0),
+        (0.0, -3.0),
+        (5.0, 0.5),
+    ]:
+        res = run(udt, args, argtypes=(float, float))
+        assert str(res[0]) == str(udt(*args)[0])
+
+
+def test_typed_division_errors():
+    def udt(n: int, m: int) -> int:
+        a = n // m
+        b = n / m
+        return a, b
+
+    for argtypes in [(int, int), (float, float), (int, float)]:
+        cg = llvm_codegen(restructure_source(udt), argtypes=argtypes)
+        with pytest.raises(ZeroDivisionError):
+            cg(7, 0)
+    # wraps instead of trapping
+    cg = llvm_codegen(restructure_source(udt), argtypes=(int, int))
+    assert cg(-(2**63), -1) == (-(2**63), float(2**63))
+
+
+def test_typed_unbox_errors():
+    def udt(n: int, m: int) -> int:
+        a = n + m
+        return a
+
+    cg = llvm_codegen(restructure_source(udt), argtypes=(int, int))
+    with pytest.raises(OverflowError):
+        cg(2**70, 1)
+    assert cg(2**62, 1) == 2**62 + 1
+    assert cg(-1, 0) == -1
+
+    cg = llvm_codegen(restructure_source(udt), argtypes=(float, float))
+    with pytest.raises(OverflowError):
+        cg(2**1100, 1.0)
+    assert cg(-1.0, 0.0) == -1.0
+
+
+def test_typed_with_objects():
+    def udt(n: int) -> tuple[int, int]:
+        it = iter(range(n))
+        a = next(it)
+        b = next(it) + n
+        return a, b
+
+    args = (5,)
+    run(udt, args, argtypes=(int,))
+
+
+def test_typed_bad_arguments():
+    def udt(n: int, m: int) -> int:
+        a = n + m
+        return a
+
+    lam_node = restructure_source(udt)
+    with pytest.raises(ValueError):
+        llvm_codegen(lam_node, argtypes=(int,))
+    with pytest.raises(ValueError):
+        llvm_codegen(lam_node, argtypes=(int, str))
+    cg = llvm_codegen(lam_node, argtypes=(int, float))
+    assert cg(1, 2) == 3
+    with pytest.raises(TypeError):
+        cg(1.5, 2)
+
+
+def run(func, args, *, localscope=None, cache=None, **kwargs):
     expected = func(*args)
 
     lam_node = restructure_source(func)
 
     assert localscope is None
 
-    cg = llvm_codegen(lam_node)
+    cg = llvm_codegen(lam_node, cache=cache, **kwargs)
     res = cg(*args)
     assert res == expected
+    return res
@@ -59,9 +59,12 @@ class MakeTypeInferRules(grammar.TreeRewriter[ase.SExpr]):
             return tp.expr("isa", lhs, rhs)
 
     def find_arg(self, orig_body: ase.SExpr) -> Iterator[ase.SExpr]:
-        for parents, child in ase.walk_descendants(orig_body):
+        def count_lams(lam_depth: int, parent: ase.SExpr) -> int:
+            return lam_depth + (parent._head == "Lam")
+
+        descendants = ase.walk_descendants_fold(orig_body, count_lams, 0)
+        for lam_depth, child in descendants:
             if child._head == "Arg":
-                lam_depth = len([p for p in parents if p._head == "Lam"])
                 [argidx] = child._args
                 if argidx == lam_depth:
                     yield child